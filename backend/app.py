@@ -6,16 +6,24 @@ import plotly.graph_objects as go
 import pandas as pd
 from datetime import datetime
 from functools import lru_cache
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_cors import CORS
+import gzip
+import hashlib
+import hmac
+import io
 import json
+import math
 import numpy as np
 from werkzeug.utils import secure_filename
 import threading
 import time
 import requests
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 # Import pybaseball functions
 try:
@@ -28,6 +36,26 @@ except ImportError:
     print("Warning: pybaseball not available. Install with: pip install pybaseball")
     PYBASEBALL_AVAILABLE = False
 
+# Optional fast serialization backends
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
 # --- Flask Server and Authentication Setup ---
 server = Flask(__name__)
 server.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', os.urandom(24).hex())
@@ -84,6 +112,29 @@ COUNT_DIFFICULTY_MODIFIER = {
     '3-0': 1.0, '3-1': 1.0, '3-2': 1.0
 }
 
+# Refit weights (see refit_count_weights.py) replace the defaults above when present
+COUNT_WEIGHTS_FILE = os.environ.get('COUNT_WEIGHTS_FILE', 'count_weights.json')
+COUNT_WEIGHTS_VERSION = 'default'
+
+def load_count_weights(path):
+    """Load a versioned weights file into COUNT_WEIGHTS / COUNT_DIFFICULTY_MODIFIER in place"""
+    global COUNT_WEIGHTS_VERSION
+    with open(path) as f:
+        refit = json.load(f)
+    weights, modifiers = refit['count_weights'], refit['count_difficulty_modifier']
+    if set(weights) != set(COUNT_WEIGHTS) or set(modifiers) != set(COUNT_DIFFICULTY_MODIFIER):
+        raise ValueError(f"{path} does not cover all 12 counts")
+    COUNT_WEIGHTS.update(weights)
+    COUNT_DIFFICULTY_MODIFIER.update(modifiers)
+    COUNT_WEIGHTS_VERSION = refit.get('version', path)
+
+if os.path.exists(COUNT_WEIGHTS_FILE):
+    try:
+        load_count_weights(COUNT_WEIGHTS_FILE)
+        print(f"Loaded count weights version {COUNT_WEIGHTS_VERSION} from {COUNT_WEIGHTS_FILE}")
+    except Exception as e:
+        print(f"Warning: could not load {COUNT_WEIGHTS_FILE}, using default weights: {e}")
+
 # --- MLB Player Database ---
 PUSH_PERFORMANCE_PITCHERS = {
     "Garrett Crochet": {"id": 676979, "level": "MLB"},
@@ -108,7 +159,88 @@ def get_pitcher_options(league):
     }
     return [{'label': name, 'value': data['id']} for name, data in filtered_pitchers.items()]
 
+# --- Upstream Resilience ---
+UPSTREAM_TIMEOUT_SECONDS = float(os.environ.get('UPSTREAM_TIMEOUT_SECONDS', 60))
+UPSTREAM_MAX_CONCURRENCY = int(os.environ.get('UPSTREAM_MAX_CONCURRENCY', 4))
+UPSTREAM_QUEUE_SECONDS = 5  # how long a request waits for a free upstream slot
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 60
+STATCAST_FRESH_SECONDS = int(os.environ.get('STATCAST_FRESH_SECONDS', 6 * 3600))
+STATCAST_CACHE_SIZE = 50
+
+class UpstreamUnavailable(Exception):
+    """Statcast could not be reached and there is no cached data to stand in"""
+
+class CircuitBreaker:
+    """Fails fast after repeated upstream errors, letting one trial call through after a cool-down.
+
+    A trial that never reports back (half_open for another reset_seconds) is
+    replaced by a new one, so a lost trial cannot keep the circuit open."""
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if time.time() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.state = 'closed'
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.time()
+
+statcast_breaker = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
+# Bulkhead: a slot is held until the upstream call really returns, even after its
+# deadline has passed, so hung Savant calls cannot pile up beyond this limit
+_upstream_slots = threading.BoundedSemaphore(UPSTREAM_MAX_CONCURRENCY)
+_upstream_pool = ThreadPoolExecutor(max_workers=UPSTREAM_MAX_CONCURRENCY)
+
+def call_upstream(fn, *args):
+    """Run one pybaseball call behind the circuit breaker, bulkhead and deadline"""
+    # Take the slot first so a half-open trial is only granted to a call that will run
+    if not _upstream_slots.acquire(timeout=UPSTREAM_QUEUE_SECONDS):
+        raise UpstreamUnavailable('too many concurrent Statcast calls')
+    if not statcast_breaker.allow():
+        _upstream_slots.release()
+        raise UpstreamUnavailable('circuit open after repeated Statcast failures')
+
+    future = _upstream_pool.submit(fn, *args)
+    future.add_done_callback(lambda _: _upstream_slots.release())
+    try:
+        result = future.result(timeout=UPSTREAM_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        statcast_breaker.record_failure()
+        raise UpstreamUnavailable(f'{fn.__name__} timed out after {UPSTREAM_TIMEOUT_SECONDS:g}s')
+    except Exception as e:
+        statcast_breaker.record_failure()
+        raise UpstreamUnavailable(f'{fn.__name__} failed: {e}') from e
+    statcast_breaker.record_success()
+    return result
+
+# --- Data Fetching ---
 @lru_cache(maxsize=20)
+def lookup_player(last_name, first_name):
+    # Upstream errors raise, so lru_cache only keeps successful lookups
+    return call_upstream(playerid_lookup, last_name, first_name)
+
 def get_batter_id(batter_name_str):
     if not PYBASEBALL_AVAILABLE:
         return None, "pybaseball not available"
@@ -119,26 +251,24 @@ def get_batter_id(batter_name_str):
         parts = batter_name_str.split()
         last_name = parts[-1]
         first_name = " ".join(parts[:-1])
-        lookup = playerid_lookup(last_name, first_name)
+        lookup = lookup_player(last_name, first_name)
         if not lookup.empty:
             return lookup['key_mlbam'].iloc[0], None
         return None, "Player not found"
+    except UpstreamUnavailable:
+        raise  # an outage is a 503, not a bad name
     except Exception as e:
         return None, f"Lookup error: {e}"
 
-@lru_cache(maxsize=50)
-def get_statcast_data(player_id, years_tuple, player_type):
-    if not PYBASEBALL_AVAILABLE:
-        return pd.DataFrame()
-    
+def fetch_statcast_data(player_id, years_tuple, player_type):
     all_data = []
     for year in years_tuple:
         start_date, end_date = f'{year}-03-01', f'{year}-11-30'
         print(f"--- Fetching {player_type} data for ID {player_id} in {year} ---")
         if player_type == 'pitcher':
-            df = statcast_pitcher(start_date, end_date, player_id)
+            df = call_upstream(statcast_pitcher, start_date, end_date, player_id)
         else: # batter
-            df = statcast_batter(start_date, end_date, player_id)
+            df = call_upstream(statcast_batter, start_date, end_date, player_id)
         if not df.empty:
             all_data.append(df)
     
@@ -147,6 +277,90 @@ def get_statcast_data(player_id, years_tuple, player_type):
     
     return preprocess_all_metrics(pd.concat(all_data, ignore_index=True))
 
+# key -> {'df': DataFrame, 'fetched_at': epoch seconds}, least recently used first
+_statcast_cache = OrderedDict()
+_statcast_refreshing = set()
+_statcast_lock = threading.Lock()
+
+def _store_statcast(key, df):
+    with _statcast_lock:
+        _statcast_cache[key] = {'df': df, 'fetched_at': time.time()}
+        _statcast_cache.move_to_end(key)
+        while len(_statcast_cache) > STATCAST_CACHE_SIZE:
+            _statcast_cache.popitem(last=False)
+
+def _refresh_statcast(key):
+    try:
+        _store_statcast(key, fetch_statcast_data(*key))
+    except UpstreamUnavailable as e:
+        print(f"Background refresh failed for {key}: {e}")
+    finally:
+        with _statcast_lock:
+            _statcast_refreshing.discard(key)
+
+# Seasons of a multi-year request are fetched and aggregated concurrently
+_season_pool = ThreadPoolExecutor(max_workers=8)
+
+def get_statcast_data(player_id, years_tuple, player_type):
+    """Preprocessed Statcast frame for one or more seasons.
+
+    Each season is its own cache entry, so changing the selection only fetches
+    the seasons that are not cached yet; several seasons are fetched concurrently."""
+    if len(years_tuple) == 1:
+        return get_season_data(player_id, years_tuple, player_type)
+    seasons = list(_season_pool.map(lambda year: get_season_data(player_id, (year,), player_type), years_tuple))
+    seasons = [df for df in seasons if not df.empty]
+    if not seasons:
+        return pd.DataFrame()
+    return pd.concat(seasons, ignore_index=True)
+
+def get_season_data(player_id, years_tuple, player_type):
+    """Cached Statcast frame for one season with stale-while-revalidate.
+
+    Fresh entries are returned as is. Stale entries are still returned immediately
+    while one background refresh runs, so an upstream incident only costs freshness.
+    A cold miss fetches synchronously and raises UpstreamUnavailable on failure."""
+    if not PYBASEBALL_AVAILABLE:
+        return pd.DataFrame()
+
+    key = (player_id, years_tuple, player_type)
+    with _statcast_lock:
+        entry = _statcast_cache.get(key)
+        if entry is not None:
+            _statcast_cache.move_to_end(key)
+            if time.time() - entry['fetched_at'] >= STATCAST_FRESH_SECONDS and key not in _statcast_refreshing:
+                _statcast_refreshing.add(key)
+                threading.Thread(target=_refresh_statcast, args=(key,), daemon=True).start()
+    if entry is not None:
+        return entry['df']
+
+    df = fetch_statcast_data(player_id, years_tuple, player_type)
+    _store_statcast(key, df)
+    return df
+
+def statcast_fetched_at(player_id, years_tuple, player_type):
+    """Fetch time of each season's cache entry (None where it is not cached)"""
+    entries = [_statcast_cache.get((player_id, (year,), player_type)) for year in years_tuple]
+    return tuple(entry['fetched_at'] if entry else None for entry in entries)
+
+def data_freshness(keys):
+    """Staleness marker for the Statcast frames a response was built from"""
+    fetched = [t for key in keys for t in statcast_fetched_at(*key) if t is not None]
+    if not fetched:
+        return {'stale': False, 'age_seconds': None}
+    age = time.time() - min(fetched)
+    return {'stale': age >= STATCAST_FRESH_SECONDS, 'age_seconds': int(age)}
+
+def load_pitcher_frame(pitcher_id, pitcher_level, years):
+    """Load a pitcher's raw pitch data: uploaded CSV for MiLB, Statcast for MLB.
+    Returns None if the MiLB file has not been uploaded."""
+    if pitcher_level == 'MiLB':
+        csv_path = os.path.join(server.config['UPLOAD_FOLDER'], f'{pitcher_id}.csv')
+        if not os.path.exists(csv_path):
+            return None
+        return pd.read_csv(csv_path)
+    return get_statcast_data(pitcher_id, tuple(sorted(years)), 'pitcher')
+
 def preprocess_all_metrics(df):
     # Defensive: ensure DataFrame is contiguous and not a view
     df = df.copy()
@@ -495,6 +709,1293 @@ def add_rate_columns(df):
     print('add_rate_columns END shape:', df.shape, 'index:', df.index)
     return df
 
+# --- Vectorized Counter Aggregation and PER Scoring ---
+# Counts are laid out as balls * 3 + strikes, which matches the order of COUNT_WEIGHTS
+COUNT_ORDER = list(COUNT_WEIGHTS.keys())
+COUNTER_COLUMNS = ['pitches', 'whiff', 'swing', 'chase', 'out_of_zone', 'is_weak_contact', 'is_hard_hit', 'bip', 'is_called_strike']
+COUNTER_INDEX = {col: i for i, col in enumerate(COUNTER_COLUMNS)}
+HANDS = ['L', 'R']
+
+# rate name -> (numerator counter, denominator counter)
+RATE_DEFINITIONS = {
+    'whiff_rate': ('whiff', 'swing'),
+    'chase_rate': ('chase', 'out_of_zone'),
+    'weak_contact_rate': ('is_weak_contact', 'bip'),
+    'hard_hit_rate': ('is_hard_hit', 'bip'),
+    'called_strike_rate': ('is_called_strike', 'pitches')
+}
+
+WEIGHT_TO_RATE = {
+    'is_whiff': 'whiff_rate',
+    'is_chase': 'chase_rate',
+    'is_weak_contact': 'weak_contact_rate',
+    'is_called_strike': 'called_strike_rate',
+    'is_hard_hit': 'hard_hit_rate'
+}
+
+# Piecewise-linear percentile -> PER mapping used by calculate_percentile_score
+PER_PERCENTILE_BREAKPOINTS = np.array([0.0, 2.0, 5.0, 10.0, 20.0, 40.0, 60.0, 80.0, 100.0])
+PER_SCORE_BREAKPOINTS = np.array([25.0, 35.0, 45.0, 55.0, 65.0, 75.0, 85.0, 95.0, 100.0])
+
+_vectorized_erf = np.frompyfunc(math.erf, 1, 1)
+
+def _fast_erf(x):
+    """Abramowitz & Stegun 7.1.26 (|error| < 1.5e-7), for bulk resample scoring"""
+    sign = np.sign(x)
+    x = np.abs(x)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poly = ((((1.061405429 * t - 1.453152027) * t + 1.421413741) * t - 0.284496736) * t + 0.254829592) * t
+    return sign * (1.0 - poly * np.exp(-x * x))
+
+def count_index(df):
+    """Map each pitch to its position in COUNT_ORDER (-1 for invalid counts)"""
+    balls = pd.to_numeric(df['balls'], errors='coerce').to_numpy(dtype=float)
+    strikes = pd.to_numeric(df['strikes'], errors='coerce').to_numpy(dtype=float)
+    valid = (balls >= 0) & (balls <= 3) & (strikes >= 0) & (strikes <= 2)
+    idx = np.full(len(df), -1, dtype=np.int64)
+    idx[valid] = (balls[valid] * 3 + strikes[valid]).astype(np.int64)
+    return idx
+
+def counter_matrix(df):
+    """Per-pitch counter values as an (n, counter) array"""
+    values = np.ones((len(df), len(COUNTER_COLUMNS)))
+    for k, col in enumerate(COUNTER_COLUMNS):
+        if col != 'pitches':
+            values[:, k] = df[col].to_numpy(dtype=float)
+    return values
+
+def aggregate_counters(counts, type_codes, values, n_types):
+    """Sum per-pitch counter rows into a (count, pitch_type, counter) tensor"""
+    n_counts = len(COUNT_ORDER)
+    counters = np.zeros((n_counts, n_types, len(COUNTER_COLUMNS)))
+    keep = (type_codes >= 0) & (counts >= 0)
+    if n_types == 0 or not keep.any():
+        return counters
+    flat = counts[keep] * n_types + type_codes[keep]
+    kept_values = values[keep]
+    for k in range(len(COUNTER_COLUMNS)):
+        counters[:, :, k] = np.bincount(flat, weights=kept_values[:, k], minlength=n_counts * n_types).reshape(n_counts, n_types)
+    return counters
+
+def build_counter_tensor(df, pitch_types):
+    """Aggregate a preprocessed frame into a (count, pitch_type, counter) tensor"""
+    if df.empty:
+        return np.zeros((len(COUNT_ORDER), len(pitch_types), len(COUNTER_COLUMNS)))
+    type_codes = pd.Categorical(df['pitch_type'], categories=list(pitch_types)).codes
+    return aggregate_counters(count_index(df), type_codes, counter_matrix(df), len(pitch_types))
+
+def counter_rates(counters):
+    """Compute the five PER rates from a counter tensor (counter axis last)"""
+    rates = {}
+    for rate, (num, den) in RATE_DEFINITIONS.items():
+        numerator = counters[..., COUNTER_INDEX[num]]
+        denominator = counters[..., COUNTER_INDEX[den]]
+        rates[rate] = np.divide(numerator, denominator, out=np.zeros_like(numerator, dtype=float), where=denominator != 0)
+    return rates
+
+def vectorized_percentile_score(rates, metric, benchmarks, league='mlb', exact=True):
+    """Array version of calculate_percentile_score; exact=False trades math.erf for a fast approximation"""
+    rates = np.asarray(rates, dtype=float)
+    if metric not in benchmarks:
+        return np.full(rates.shape, 50.0)
+
+    adjusted = rates * MILB_ADJUSTMENT if league.lower() == 'milb' else rates
+    std = max(benchmarks[metric]['std'], 0.05)
+    if metric == 'hard_hit_rate':
+        z_scores = (benchmarks[metric]['mean'] - adjusted) / std
+    else:
+        z_scores = (adjusted - benchmarks[metric]['mean']) / std
+
+    if exact:
+        erf = _vectorized_erf(z_scores / math.sqrt(2)).astype(float)
+    else:
+        erf = _fast_erf(z_scores / math.sqrt(2))
+    percentile = 50 * (1 + erf)
+    scores = np.round(np.interp(percentile, PER_PERCENTILE_BREAKPOINTS, PER_SCORE_BREAKPOINTS), 1)
+    return np.where(np.isnan(rates), 50.0, scores)
+
+def count_weight_arrays():
+    """COUNT_WEIGHTS as a (count, metric) matrix in WEIGHT_TO_RATE order, plus difficulty modifiers"""
+    weight_matrix = np.array([[COUNT_WEIGHTS[count].get(key, 0.0) for key in WEIGHT_TO_RATE] for count in COUNT_ORDER])
+    modifiers = np.array([COUNT_DIFFICULTY_MODIFIER.get(count, 1.0) for count in COUNT_ORDER])
+    return weight_matrix, modifiers
+
+def score_rates(rates, benchmarks, league='mlb', count_idx=None, exact=True):
+    """Score rate arrays with the count-weighted PER model.
+
+    Arrays are shaped (..., count, pitch_type), or (..., row) when count_idx
+    gives the COUNT_ORDER position of each row."""
+    metric_scores = {rate: vectorized_percentile_score(values, rate, benchmarks, league, exact) for rate, values in rates.items()}
+
+    weight_matrix, modifiers = count_weight_arrays()
+    if count_idx is None:
+        weights, modifier = weight_matrix[:, None, :], modifiers[:, None]
+    else:
+        weights, modifier = weight_matrix[count_idx], modifiers[count_idx]
+    total_weight = weights.sum(axis=-1)
+
+    composite = sum(metric_scores[rate] * weights[..., i] for i, rate in enumerate(WEIGHT_TO_RATE.values()))
+    composite = np.where(total_weight > 0, composite / np.where(total_weight > 0, total_weight, 1), 50.0)
+    return np.round(composite, 1) * modifier
+
+def score_counters(counters, benchmarks, league='mlb'):
+    """Score a counter tensor shaped (..., count, pitch_type, counter)"""
+    return score_rates(counter_rates(counters), benchmarks, league)
+
+# generate_recommendation_report names for the aggregated counters
+REPORT_COUNTER_NAMES = {'is_weak_contact': 'weak_contact', 'is_hard_hit': 'hard_hit', 'is_called_strike': 'called_strike'}
+
+def count_report(counters, scores, rates, pitch_types, c, min_pitches=10, top_n=3):
+    """Top-n report rows for COUNT_ORDER[c] from a scored counter tensor (None if no pitch qualifies)"""
+    pitches = counters[c, :, COUNTER_INDEX['pitches']]
+    keep = np.nonzero((pitches > 0) & (pitches >= min_pitches))[0]
+    if len(keep) == 0:
+        return None
+    report = pd.DataFrame({'pitch_type': np.asarray(pitch_types, dtype=object)[keep]})
+    for k, col in enumerate(COUNTER_COLUMNS):
+        report[REPORT_COUNTER_NAMES.get(col, col)] = counters[c, keep, k].astype(int)
+    for rate, values in rates.items():
+        report[rate] = values[c, keep]
+    report['score'] = scores[c, keep]
+    report['count'] = COUNT_ORDER[c]
+    report.sort_values(by='score', ascending=False, inplace=True)
+    return report.head(top_n)
+
+def report_from_counters(counters, pitch_types, benchmarks, league='mlb', min_pitches=10, top_n=3):
+    """Same output as generate_recommendation_report, built from a counter tensor"""
+    scores = score_counters(counters, benchmarks, league)
+    rates = counter_rates(counters)
+
+    all_count_reports = []
+    for c in range(len(COUNT_ORDER)):
+        report = count_report(counters, scores, rates, pitch_types, c, min_pitches, top_n)
+        if report is not None:
+            all_count_reports.append(report)
+    if not all_count_reports:
+        return pd.DataFrame()
+    return pd.concat(all_count_reports, ignore_index=True)
+
+# --- Bootstrap Confidence Intervals ---
+INTERVAL_FIELDS = {f'{field}_ci_{end}': np.float64 for field in ['score', *RATE_DEFINITIONS] for end in ('low', 'high')}
+BOOTSTRAP_SAMPLES = 500
+# Rows whose binomial variance n*p*(1-p) reaches this are drawn from the normal approximation
+BOOTSTRAP_NORMAL_MIN_VARIANCE = 10
+
+def binomial_resample(rng, trials, p, shape):
+    """Binomial(trials, p) draws shaped (n_samples, rows), p given per row.
+
+    Every row is first drawn as a rounded, clipped normal, which costs a
+    fraction of rng.binomial; rows without enough variance for the
+    approximation are then redrawn as exact binomials."""
+    mean = trials * p
+    sd = np.sqrt(mean * (1 - p))
+    draws = np.clip(np.rint(mean + sd * rng.standard_normal(shape)), 0, trials).astype(np.int64)
+    exact = np.broadcast_to(sd, shape).min(axis=0) ** 2 < BOOTSTRAP_NORMAL_MIN_VARIANCE
+    if exact.any():
+        draws[:, exact] = rng.binomial(np.broadcast_to(trials, shape)[:, exact], p[exact])
+    return draws
+
+def bootstrap_intervals(report_df, benchmarks, league='mlb', confidence=0.9, n_samples=BOOTSTRAP_SAMPLES, seed=None):
+    """Parametric bootstrap intervals for every rate and PER in a recommendation report.
+
+    Resamples the aggregated counters instead of pitches: binomial draws for
+    whiff/chase/called-strike given their denominators and a multinomial
+    weak/hard/other split of balls in play, every resample of a rate drawn at
+    once as (n_samples, rows) with binomial_resample.
+    Returns {'<field>_ci_low': array, '<field>_ci_high': array, ...} aligned with report_df."""
+    rng = np.random.default_rng(seed)
+
+    def counter(name):
+        return report_df[REPORT_COUNTER_NAMES.get(name, name)].to_numpy(dtype=np.int64)
+
+    def proportion(num, den):
+        return np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape), where=den != 0)
+
+    shape = (n_samples, len(report_df))
+    resampled = {}
+    for rate in ('whiff_rate', 'chase_rate', 'called_strike_rate'):
+        num, den = RATE_DEFINITIONS[rate]
+        trials = counter(den)
+        resampled[rate] = proportion(binomial_resample(rng, trials, proportion(counter(num), trials), shape), trials)
+
+    # Multinomial weak/hard/other split as a binomial plus a conditional binomial
+    bip, weak, hard = counter('bip'), counter('is_weak_contact'), counter('is_hard_hit')
+    weak_draws = binomial_resample(rng, bip, proportion(weak, bip), shape)
+    hard_draws = binomial_resample(rng, bip - weak_draws, np.clip(proportion(hard, bip - weak), 0, 1), shape)
+    resampled['weak_contact_rate'] = proportion(weak_draws, bip)
+    resampled['hard_hit_rate'] = proportion(hard_draws, bip)
+
+    count_idx = np.array([COUNT_ORDER.index(count) for count in report_df['count']])
+    resampled['score'] = score_rates(resampled, benchmarks, league, count_idx=count_idx, exact=False)
+
+    alpha = (1 - confidence) / 2
+    intervals = {}
+    for field, values in resampled.items():
+        intervals[f'{field}_ci_low'], intervals[f'{field}_ci_high'] = np.quantile(values, [alpha, 1 - alpha], axis=0)
+    return intervals
+
+# --- Indexed Situational Filters ---
+# request filter name -> Statcast column holding a categorical value
+CATEGORICAL_FILTERS = {
+    'game_type': 'game_type',
+    'inning': 'inning',
+    'outs': 'outs_when_up',
+    'times_through_order': 'n_thruorder_pitcher'
+}
+
+# Base state is a bitmask: 1 = runner on first, 2 = second, 4 = third
+RUNNER_STATES = {
+    'empty': [0],
+    'men_on': [1, 2, 3, 4, 5, 6, 7],
+    'risp': [2, 3, 4, 5, 6, 7],
+    'loaded': [7]
+}
+
+class PitchIndex:
+    """Cached, query-ready view of one player's pitches.
+
+    Rows are sorted by game_date and split into partitions by handedness
+    (batter stand for pitcher data, p_throws for batter data). Each partition
+    keeps its per-pitch counters as a numpy matrix plus a boolean bitmap per
+    categorical filter value, so filters resolve to row selections that go
+    straight into aggregate_counters without filtering the DataFrame.
+    Partitions also record each row's position in the source frame, which
+    stays available as .frame for exports.
+    """
+
+    def __init__(self, df, hand_column):
+        self.frame = df
+        self._previous_codes = None
+        self._location_grids = {}
+        self.pitch_types = sorted(df['pitch_type'].dropna().unique()) if not df.empty else []
+        self.has_dates = 'game_date' in df.columns and not df.empty
+        if df.empty:
+            # Seasons without data come back as frames with no columns at all
+            self.partitions = {hand: self._empty_partition() for hand in HANDS}
+            return
+        df = df.assign(source_row=np.arange(len(df)))
+        if self.has_dates:
+            df['game_date'] = pd.to_datetime(df['game_date'], errors='coerce')
+            df = df.sort_values('game_date', kind='stable')
+        self.partitions = {hand: self._build_partition(df[df[hand_column] == hand]) for hand in HANDS}
+
+    @staticmethod
+    def _empty_partition():
+        return {
+            'size': 0,
+            'counts': np.empty(0, dtype=np.int64),
+            'type_codes': np.empty(0, dtype=np.int8),
+            'values': np.empty((0, len(COUNTER_COLUMNS))),
+            'dates': None,
+            'positions': np.empty(0, dtype=np.int64),
+            'cells': np.empty(0, dtype=np.int64),
+            'bitmaps': {}
+        }
+
+    def _build_partition(self, df):
+        partition = {
+            'size': len(df),
+            'counts': count_index(df),
+            'type_codes': pd.Categorical(df['pitch_type'], categories=self.pitch_types).codes,
+            'values': counter_matrix(df),
+            'dates': df['game_date'].to_numpy(dtype='datetime64[ns]') if self.has_dates else None,
+            'positions': df['source_row'].to_numpy(),
+            'cells': location_cells(df),
+            'bitmaps': {}
+        }
+        for name, column in CATEGORICAL_FILTERS.items():
+            if column not in df.columns:
+                continue
+            values = df[column]
+            if name != 'game_type':
+                values = pd.to_numeric(values, errors='coerce').astype('Int64')
+            keys = values.astype(str).to_numpy()
+            partition['bitmaps'][name] = {key: keys == key for key in np.unique(keys)}
+        if all(col in df.columns for col in ('on_1b', 'on_2b', 'on_3b')):
+            base_state = (df['on_1b'].notna().to_numpy() * 1 + df['on_2b'].notna().to_numpy() * 2 + df['on_3b'].notna().to_numpy() * 4)
+            partition['bitmaps']['runners'] = {state: base_state == state for state in range(8)}
+        return partition
+
+    def select(self, hand, filters):
+        """Resolve filters to (row slice, boolean mask within the slice) for one partition"""
+        partition = self.partitions[hand]
+        lo, hi = 0, partition['size']
+
+        start_date, end_date = filters.get('start_date'), filters.get('end_date')
+        if start_date or end_date:
+            if partition['dates'] is None:
+                raise ValueError('date filters need game_date in the data')
+            if start_date:
+                lo = np.searchsorted(partition['dates'], np.datetime64(start_date, 'ns'), side='left')
+            if end_date:
+                hi = np.searchsorted(partition['dates'], np.datetime64(end_date, 'ns') + np.timedelta64(1, 'D'), side='left')
+            hi = max(lo, hi)
+
+        mask = None
+        for name, wanted in filters.items():
+            if name in ('start_date', 'end_date') or wanted in (None, []):
+                continue
+            if name not in CATEGORICAL_FILTERS and name != 'runners':
+                raise ValueError(f'unknown filter {name}')
+            bitmaps = partition['bitmaps'].get(name)
+            if bitmaps is None:
+                raise ValueError(f'{name} is not available for this data')
+            if not isinstance(wanted, list):
+                wanted = [wanted]
+
+            if name == 'runners':
+                unknown = [state for state in wanted if state not in RUNNER_STATES]
+                if unknown:
+                    raise ValueError(f'unknown runner states {unknown}')
+                keys = {code for state in wanted for code in RUNNER_STATES[state]}
+            else:
+                keys = {str(value) for value in wanted}
+
+            selected = np.zeros(hi - lo, dtype=bool)
+            for key in keys:
+                if key in bitmaps:
+                    selected |= bitmaps[key][lo:hi]
+            mask = selected if mask is None else mask & selected
+        return slice(lo, hi), mask
+
+    def rows(self, hand, filters=None, keys=('counts', 'type_codes', 'values', 'dates')):
+        """Selected per-pitch arrays (default counts, type_codes, values, dates) for one partition, in date order"""
+        partition = self.partitions[hand]
+        selection, mask = self.select(hand, filters or {})
+        arrays = [partition[key][selection] if partition[key] is not None else None for key in keys]
+        if mask is not None:
+            arrays = [array[mask] if array is not None else None for array in arrays]
+        return arrays
+
+    def aggregate(self, hand, filters=None):
+        """Counter tensor for one handedness partition with filters pushed down"""
+        counts, type_codes, values, _ = self.rows(hand, filters)
+        return aggregate_counters(counts, type_codes, values, len(self.pitch_types))
+
+    def positions(self, hands=HANDS, filters=None):
+        """Source-frame row positions selected by filters across partitions, in date order"""
+        positions, dates = [], []
+        for hand in hands:
+            partition = self.partitions[hand]
+            selection, mask = self.select(hand, filters or {})
+            rows = np.arange(partition['size'])[selection]
+            if mask is not None:
+                rows = rows[mask]
+            positions.append(partition['positions'][rows])
+            if self.has_dates:
+                dates.append(partition['dates'][rows])
+        positions = np.concatenate(positions)
+        if self.has_dates and len(hands) > 1:
+            positions = positions[np.argsort(np.concatenate(dates), kind='stable')]
+        return positions
+
+    def location_counters(self, hand, filters=None):
+        """Heatmap counter tensor for one partition; the unfiltered grid is built once and kept"""
+        if not filters and hand in self._location_grids:
+            return self._location_grids[hand]
+        counts, type_codes, values, cells = self.rows(hand, filters, keys=('counts', 'type_codes', 'values', 'cells'))
+        grid = location_counters(counts, type_codes, values, cells, len(self.pitch_types))
+        if not filters:
+            self._location_grids[hand] = grid
+        return grid
+
+    def previous_pitch_codes(self):
+        """previous_pitch_codes of the source frame, computed once per index"""
+        if self._previous_codes is None:
+            self._previous_codes = previous_pitch_codes(self.frame, self.pitch_types)
+        return self._previous_codes
+
+def get_season_index(player_id, year, player_type):
+    get_statcast_data(player_id, (year,), player_type)  # populates or revalidates the frame cache
+    return _cached_season_index(player_id, year, player_type, statcast_fetched_at(player_id, (year,), player_type))
+
+@lru_cache(maxsize=50)
+def _cached_season_index(player_id, year, player_type, fetched_at):
+    """fetched_at keys the index to one version of the cached frame, so refreshes rebuild it"""
+    df = get_statcast_data(player_id, (year,), player_type)
+    return PitchIndex(df, 'stand' if player_type == 'pitcher' else 'p_throws')
+
+@lru_cache(maxsize=20)
+def get_csv_pitch_index(csv_path, modified_time):
+    """Index of an uploaded MiLB file; modified_time keys the cache to the file version"""
+    return PitchIndex(preprocess_all_metrics(pd.read_csv(csv_path)), 'stand')
+
+def load_pitcher_index(pitcher_id, pitcher_level, years):
+    """PartitionedIndex counterpart of load_pitcher_frame (an uploaded MiLB file is its single partition)"""
+    if pitcher_level == 'MiLB':
+        csv_path = os.path.join(server.config['UPLOAD_FOLDER'], f'{pitcher_id}.csv')
+        if not os.path.exists(csv_path):
+            return None
+        return PartitionedIndex([get_csv_pitch_index(csv_path, os.path.getmtime(csv_path))])
+    return get_partitioned_index(pitcher_id, tuple(sorted(years)), 'pitcher')
+
+class PartitionedIndex:
+    """Per-season PitchIndexes of one player, queried as one.
+
+    Aggregations run on every season concurrently and the resulting counter
+    tensors are summed over the union of pitch types, so no multi-year frame is
+    ever concatenated and each season's index stays cached on its own. Seasons
+    are kept in year order; they never overlap in date and a plate appearance
+    never crosses seasons, so per-season rows and sequence pairs can simply be
+    concatenated or summed."""
+
+    def __init__(self, seasons):
+        self.seasons = seasons
+        self.pitch_types = sorted(set().union(*(season.pitch_types for season in seasons)))
+        self.size = sum(len(season.frame) for season in seasons)
+        self.has_dates = all(season.has_dates for season in seasons)
+        # Columns every season has, in the first season's order
+        self.columns = [column for column in seasons[0].frame.columns
+                        if all(column in season.frame.columns for season in seasons[1:])] if seasons else []
+
+    def column(self, name):
+        """One column of every season's frame, in season order"""
+        return pd.concat([season.frame[name] for season in self.seasons], ignore_index=True)
+
+    def _type_codes(self, season):
+        """Union pitch type code of each of a season's pitch types"""
+        return np.array([self.pitch_types.index(t) for t in season.pitch_types], dtype=np.int64)
+
+    def _merge(self, tensors):
+        """Sum per-season (count, pitch_type, ...) tensors over the union of pitch types"""
+        merged = np.zeros((len(COUNT_ORDER), len(self.pitch_types)) + tensors[0].shape[2:])
+        for season, tensor in zip(self.seasons, tensors):
+            merged[:, self._type_codes(season)] += tensor
+        return merged
+
+    def rows(self, hand, filters=None, keys=('counts', 'type_codes', 'values', 'dates')):
+        """PitchIndex.rows of every season concatenated in year order, with type codes over the union"""
+        per_season = [season.rows(hand, filters, keys) for season in self.seasons]
+        arrays = []
+        for k, key in enumerate(keys):
+            parts = [rows[k] for rows in per_season]
+            if key == 'type_codes':
+                # -1 (no pitch type) indexes the appended -1
+                parts = [np.append(self._type_codes(season), -1)[codes] for season, codes in zip(self.seasons, parts)]
+            arrays.append(None if any(part is None for part in parts) else np.concatenate(parts))
+        return arrays
+
+    def sequence_counters(self, hand, filters=None):
+        """(previous_pitch_type, count, pitch_type, counter) tensor; pairs are formed within each season"""
+        def season_counters(season):
+            counts, type_codes, values, _ = season.rows(hand, filters)
+            # Pairs are formed on the full plate appearance; filters apply to the pitch being thrown
+            previous_codes = season.previous_pitch_codes()[season.positions([hand], filters)]
+            return sequence_counters(counts, type_codes, values, previous_codes, len(season.pitch_types))
+
+        n_types = len(self.pitch_types)
+        merged = np.zeros((n_types, len(COUNT_ORDER), n_types, len(COUNTER_COLUMNS)))
+        for season, tensor in zip(self.seasons, _season_pool.map(season_counters, self.seasons)):
+            codes = self._type_codes(season)
+            merged[np.ix_(codes, np.arange(len(COUNT_ORDER)), codes)] += tensor
+        return merged
+
+    def export_parts(self, hands=HANDS, filters=None):
+        """(season frame, selected positions) per season, for streaming an export season by season"""
+        return [(season.frame, season.positions(hands, filters)) for season in self.seasons]
+
+    def aggregate(self, hand, filters=None):
+        return self._merge(list(_season_pool.map(lambda season: season.aggregate(hand, filters), self.seasons)))
+
+    def location_counters(self, hand, filters=None):
+        return self._merge(list(_season_pool.map(lambda season: season.location_counters(hand, filters), self.seasons)))
+
+def get_partitioned_index(player_id, years_tuple, player_type):
+    """PartitionedIndex over the seasons with data; seasons are fetched and indexed concurrently"""
+    def season_index(year):
+        if get_statcast_data(player_id, (year,), player_type).empty:
+            return None
+        return get_season_index(player_id, year, player_type)
+    return PartitionedIndex([index for index in _season_pool.map(season_index, years_tuple) if index is not None])
+
+# --- Rolling Trend Analysis ---
+def rolling_counters(dates, counts, type_codes, values, n_types, window_days=None, window_pitches=None):
+    """Rolling-window counter tensors evaluated at the end of every game date.
+
+    Builds prefix sums of the (count, pitch_type) counters in date order, so each
+    window is a single difference of two prefix rows. window_days spans calendar
+    days ending on the date; window_pitches covers the last N pitches of each
+    pitch type. Returns (game_days, windows shaped (day, count, pitch_type, counter)).
+    """
+    n_counts, n_counters = len(COUNT_ORDER), len(COUNTER_COLUMNS)
+    keep = (counts >= 0) & (type_codes >= 0) & ~np.isnat(dates)
+    days = dates[keep].astype('datetime64[D]')
+    counts, type_codes, values = counts[keep], type_codes[keep], values[keep]
+    game_days, day_idx = np.unique(days, return_inverse=True)
+    windows = np.zeros((len(game_days), n_counts, n_types, n_counters))
+    if len(game_days) == 0:
+        return game_days, windows
+
+    if window_days:
+        flat = (day_idx * n_counts + counts) * n_types + type_codes
+        daily = np.stack([
+            np.bincount(flat, weights=values[:, k], minlength=len(game_days) * n_counts * n_types)
+            for k in range(n_counters)
+        ], axis=-1).reshape(len(game_days), n_counts, n_types, n_counters)
+        prefix = np.concatenate([np.zeros((1,) + daily.shape[1:]), np.cumsum(daily, axis=0)])
+        start = np.searchsorted(game_days, game_days - np.timedelta64(window_days - 1, 'D'), side='left')
+        windows[:] = prefix[1:] - prefix[start]
+        return game_days, windows
+
+    for t in range(n_types):
+        rows = np.nonzero(type_codes == t)[0]
+        if len(rows) == 0:
+            continue
+        per_pitch = np.zeros((len(rows), n_counts, n_counters))
+        per_pitch[np.arange(len(rows)), counts[rows]] = values[rows]
+        prefix = np.concatenate([np.zeros((1, n_counts, n_counters)), np.cumsum(per_pitch, axis=0)])
+        end = np.searchsorted(days[rows], game_days, side='right')
+        start = np.maximum(end - window_pitches, 0)
+        windows[:, :, t, :] = prefix[end] - prefix[start]
+    return game_days, windows
+
+def trend_columns(game_days, windows, pitch_types, benchmarks, league='mlb', min_pitches=10):
+    """Long-format (date, pitch_type, count) table of windowed rates and PER"""
+    scores = score_counters(windows, benchmarks, league)
+    rates = counter_rates(windows)
+    pitches = windows[..., COUNTER_INDEX['pitches']]
+    d, c, t = np.nonzero((pitches > 0) & (pitches >= min_pitches))
+
+    columns = {
+        'date': np.datetime_as_string(game_days[d], unit='D').tolist(),
+        'pitch_type': np.asarray(pitch_types, dtype=object)[t].tolist(),
+        'count': np.asarray(COUNT_ORDER, dtype=object)[c].tolist(),
+        'pitches': pitches[d, c, t].astype(np.int64)
+    }
+    for rate, values in rates.items():
+        columns[rate] = values[d, c, t]
+    columns['score'] = scores[d, c, t]
+    return columns
+
+# --- Pitch Sequencing ---
+def previous_pitch_codes(df, pitch_types):
+    """Pitch type code of the pitch before each row in the same plate appearance (-1 for the first pitch).
+
+    Rows are ordered by (game_pk, at_bat_number, pitch_number) with one lexsort and
+    paired with their predecessor by a shift, so no per-at-bat grouping is needed."""
+    missing = [col for col in PITCH_KEY_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f'sequencing needs {missing} in the data')
+    game, at_bat, pitch_number = (pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float) for col in PITCH_KEY_COLUMNS)
+    order = np.lexsort((pitch_number, at_bat, game))
+    codes = pd.Categorical(df['pitch_type'], categories=list(pitch_types)).codes[order]
+
+    same_pa = (game[order][1:] == game[order][:-1]) & (at_bat[order][1:] == at_bat[order][:-1])
+    previous = np.full(len(df), -1, dtype=np.int64)
+    previous[order[1:]] = np.where(same_pa, codes[:-1], -1)
+    return previous
+
+def sequence_counters(counts, type_codes, values, previous_codes, n_types):
+    """(previous_pitch_type, count, pitch_type, counter) tensor, counted in the count the next pitch is thrown"""
+    keep = (previous_codes >= 0) & (type_codes >= 0)
+    pairs = np.where(keep, previous_codes * n_types + type_codes, -1)
+    counters = aggregate_counters(counts, pairs, values, n_types * n_types)
+    return counters.reshape(len(COUNT_ORDER), n_types, n_types, -1).transpose(1, 0, 2, 3)
+
+def sequence_columns(counters, pitch_types, benchmarks, league='mlb', min_pitches=10, top_n=3):
+    """Long (previous_pitch_type, count, pitch_type) table of the top_n follow-up pitches, best first"""
+    scores = score_counters(counters, benchmarks, league)
+    rates = counter_rates(counters)
+    pitches = counters[..., COUNTER_INDEX['pitches']]
+    eligible = (pitches > 0) & (pitches >= min_pitches)
+
+    ranked = np.argsort(np.where(eligible, -scores, np.inf), axis=-1, kind='stable')[..., :top_n]
+    p, c, r = np.nonzero(np.take_along_axis(eligible, ranked, axis=-1))
+    t = ranked[p, c, r]
+
+    pitch_types = np.asarray(pitch_types, dtype=object)
+    columns = {
+        'previous_pitch_type': pitch_types[p].tolist(),
+        'count': np.asarray(COUNT_ORDER, dtype=object)[c].tolist(),
+        'pitch_type': pitch_types[t].tolist(),
+        'pitches': pitches[p, c, t].astype(np.int64)
+    }
+    for rate, values in rates.items():
+        columns[rate] = values[p, c, t]
+    columns['score'] = scores[p, c, t]
+    return columns
+
+# --- Location Heatmaps ---
+# Fixed bins in feet, catcher's view: plate_x from the middle of the plate, plate_z above the ground
+HEATMAP_X_EDGES = np.linspace(-2.0, 2.0, 13)
+HEATMAP_Z_EDGES = np.linspace(0.5, 4.5, 13)
+
+def location_cells(df):
+    """Flat heatmap cell per pitch (x_bin * n_z + z_bin), -1 without a location.
+    Pitches beyond the grid land in the edge cells."""
+    if 'plate_x' not in df.columns or 'plate_z' not in df.columns:
+        return np.full(len(df), -1, dtype=np.int64)
+    x = pd.to_numeric(df['plate_x'], errors='coerce').to_numpy(dtype=float)
+    z = pd.to_numeric(df['plate_z'], errors='coerce').to_numpy(dtype=float)
+    n_x, n_z = len(HEATMAP_X_EDGES) - 1, len(HEATMAP_Z_EDGES) - 1
+    x_bin = np.clip(np.searchsorted(HEATMAP_X_EDGES, x, side='right') - 1, 0, n_x - 1)
+    z_bin = np.clip(np.searchsorted(HEATMAP_Z_EDGES, z, side='right') - 1, 0, n_z - 1)
+    return np.where(np.isnan(x) | np.isnan(z), -1, x_bin * n_z + z_bin)
+
+def location_counters(counts, type_codes, values, cells, n_types):
+    """(count, pitch_type, x_bin, z_bin, counter) tensor from one bincount per counter"""
+    n_x, n_z = len(HEATMAP_X_EDGES) - 1, len(HEATMAP_Z_EDGES) - 1
+    keep = (cells >= 0) & (type_codes >= 0)
+    codes = np.where(keep, type_codes.astype(np.int64) * (n_x * n_z) + cells, -1)
+    counters = aggregate_counters(counts, codes, values, n_types * n_x * n_z)
+    return counters.reshape(len(COUNT_ORDER), n_types, n_x, n_z, -1)
+
+def heatmap_columns(counters, pitch_types, benchmarks, league='mlb', min_pitches=1):
+    """Long (pitch_type, count, x_bin, z_bin) table of occupied cells with frequency, rates and PER"""
+    # score_counters expects (..., count, pitch_type, counter)
+    grid = np.moveaxis(counters, (2, 3), (0, 1))
+    scores = score_counters(grid, benchmarks, league)
+    rates = counter_rates(grid)
+    pitches = grid[..., COUNTER_INDEX['pitches']]
+    totals = pitches.sum(axis=(0, 1))
+
+    c, t, x, z = np.nonzero(np.moveaxis(pitches >= max(min_pitches, 1), (0, 1), (2, 3)))
+    columns = {
+        'pitch_type': np.asarray(pitch_types, dtype=object)[t].tolist(),
+        'count': np.asarray(COUNT_ORDER, dtype=object)[c].tolist(),
+        'x_bin': x.astype(np.int64),
+        'z_bin': z.astype(np.int64),
+        'pitches': pitches[x, z, c, t].astype(np.int64),
+        'frequency': pitches[x, z, c, t] / totals[c, t]
+    }
+    for rate, values in rates.items():
+        columns[rate] = values[x, z, c, t]
+    columns['score'] = scores[x, z, c, t]
+    return columns
+
+# --- Arsenal Similarity ---
+ARSENAL_PITCH_TYPES = ['FF', 'SI', 'FC', 'SL', 'ST', 'SV', 'CU', 'KC', 'CH', 'FS']
+# MiLB exports label pitches by name; lowercased names -> Statcast codes
+PITCH_NAME_CODES = {
+    '4-seam fastball': 'FF', 'four-seam fastball': 'FF', 'fastball': 'FF',
+    'sinker': 'SI', '2-seam fastball': 'SI', 'two-seam fastball': 'SI',
+    'cutter': 'FC', 'slider': 'SL', 'sweeper': 'ST', 'slurve': 'SV',
+    'curveball': 'CU', 'knuckle curve': 'KC', 'changeup': 'CH',
+    'split-finger': 'FS', 'splitter': 'FS',
+}
+# pfx_x is mirrored for left-handers so arm-side movement lines up across hands
+ARSENAL_PHYSICAL_COLUMNS = ['release_speed', 'release_spin_rate', 'pfx_x', 'pfx_z']
+ARSENAL_COLUMNS = ['pitcher', 'player_name', 'p_throws', 'pitch_type', 'description', 'zone', 'launch_speed',
+                   'balls', 'strikes', 'events', 'woba_value'] + ARSENAL_PHYSICAL_COLUMNS
+ARSENAL_MIN_PITCHES = 5  # per count and pitch type before its PER counts as a feature
+ARSENAL_INDEX_FILE = os.environ.get('ARSENAL_INDEX_FILE', 'arsenal_index.npz')
+ARSENAL_INDEX = None
+
+def arsenal_feature_names():
+    names = [f'{pitch_type}_usage' for pitch_type in ARSENAL_PITCH_TYPES]
+    for pitch_type in ARSENAL_PITCH_TYPES:
+        names += [f'{pitch_type}_{col}' for col in ARSENAL_PHYSICAL_COLUMNS]
+        names += [f'{pitch_type}_per_{count_str}' for count_str in COUNT_ORDER]
+    return names
+
+def arsenal_pitch_types(pitch_types):
+    """Statcast codes for a pitch_type column that may hold codes or pitch names"""
+    names = pitch_types.astype(str).str.strip().str.lower()
+    return names.map(PITCH_NAME_CODES).fillna(pitch_types)
+
+def arsenal_features(df, benchmarks, league='mlb'):
+    """Raw (pitcher, feature) matrix for every pitcher in a preprocessed frame.
+
+    Per pitch type: usage share, mean velocity / spin / movement, and PER in each
+    count. Everything is a bincount over a (pitcher, pitch_type) code, so a
+    league-wide frame is handled in one pass. Missing values are NaN.
+    Returns (pitcher_ids, features)."""
+    pitcher_codes, pitcher_ids = pd.factorize(df['pitcher'])
+    n_pitchers, n_types = len(pitcher_ids), len(ARSENAL_PITCH_TYPES)
+    type_codes = pd.Categorical(arsenal_pitch_types(df['pitch_type']), categories=ARSENAL_PITCH_TYPES).codes.astype(np.int64)
+    groups = np.where(type_codes >= 0, pitcher_codes * n_types + type_codes, -1)
+    kept = groups >= 0
+
+    totals = np.bincount(pitcher_codes, minlength=n_pitchers)
+    pitches = np.bincount(groups[kept], minlength=n_pitchers * n_types).reshape(n_pitchers, n_types)
+    usage = pitches / np.maximum(totals, 1)[:, None]
+
+    mirror = np.where(df['p_throws'].to_numpy() == 'L', -1.0, 1.0)
+    physical = np.full((n_pitchers, n_types, len(ARSENAL_PHYSICAL_COLUMNS)), np.nan)
+    for k, col in enumerate(ARSENAL_PHYSICAL_COLUMNS):
+        if col not in df.columns:
+            continue
+        values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+        if col == 'pfx_x':
+            values = values * mirror
+        finite = kept & np.isfinite(values)
+        sums = np.bincount(groups[finite], weights=values[finite], minlength=n_pitchers * n_types)
+        counts = np.bincount(groups[finite], minlength=n_pitchers * n_types)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            physical[..., k] = (sums / counts).reshape(n_pitchers, n_types)
+
+    # (count, pitcher * type, counter) -> (pitcher, count, type, counter)
+    counters = aggregate_counters(count_index(df), groups, counter_matrix(df), n_pitchers * n_types)
+    counters = counters.reshape(len(COUNT_ORDER), n_pitchers, n_types, -1).transpose(1, 0, 2, 3)
+    per = score_counters(counters, benchmarks, league)
+    per = np.where(counters[..., COUNTER_INDEX['pitches']] >= ARSENAL_MIN_PITCHES, per, np.nan)
+
+    per_type = np.concatenate([physical, per.transpose(0, 2, 1)], axis=-1)
+    return np.asarray(pitcher_ids), np.concatenate([usage, per_type.reshape(n_pitchers, -1)], axis=1)
+
+def normalize_arsenal(features, means, stds):
+    """Standardize, weight each pitch type's block by sqrt(usage) and scale rows to unit length.
+
+    Missing values become the pool mean (0 after standardizing), and the usage
+    weighting keeps a rarely thrown pitch from dominating the distance."""
+    n_types = len(ARSENAL_PITCH_TYPES)
+    z = np.nan_to_num((features - means) / np.where(stds > 0, stds, 1))
+    usage = np.nan_to_num(features[:, :n_types])
+    per_type = z[:, n_types:].reshape(len(z), n_types, -1) * np.sqrt(usage)[:, :, None]
+    vectors = np.concatenate([z[:, :n_types], per_type.reshape(len(z), -1)], axis=1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+def load_arsenal_index(path):
+    """Load the league pool written by build_arsenal_index.py"""
+    global ARSENAL_INDEX
+    with np.load(path, allow_pickle=False) as stored:
+        index = {key: stored[key] for key in stored.files}
+    if index['feature_names'].tolist() != arsenal_feature_names():
+        raise ValueError(f"{path} was built with a different feature layout")
+    index['version'] = str(index['version'])
+    # Indexes built before the league was stored were scored with MLB benchmarks
+    index['league'] = str(index['league']) if 'league' in index else 'MLB'
+    ARSENAL_INDEX = index
+
+def nearest_arsenals(vector, k=10, exclude_id=None):
+    """Top-k pool pitchers by cosine similarity: one matrix-vector product plus argpartition"""
+    similarity = ARSENAL_INDEX['matrix'] @ vector
+    if exclude_id is not None:
+        similarity = np.where(ARSENAL_INDEX['pitcher_ids'] == exclude_id, -np.inf, similarity)
+    k = min(k, len(similarity))
+    top = np.argpartition(-similarity, k - 1)[:k]
+    return top[np.argsort(-similarity[top])], similarity
+
+if os.path.exists(ARSENAL_INDEX_FILE):
+    try:
+        load_arsenal_index(ARSENAL_INDEX_FILE)
+        print(f"Loaded arsenal index version {ARSENAL_INDEX['version']} ({len(ARSENAL_INDEX['pitcher_ids'])} pitchers) from {ARSENAL_INDEX_FILE}")
+    except Exception as e:
+        print(f"Warning: could not load {ARSENAL_INDEX_FILE}, similarity search disabled: {e}")
+
+# --- Lineup Matchup Matrix ---
+def dominant_value(values, default):
+    """Most common value of a series, or default if it is empty"""
+    values = values.dropna()
+    if values.empty:
+        return default
+    return values.value_counts().idxmax()
+
+def hand_split_tensors(df, column, pitch_types):
+    """Counter tensors split by handedness column -> shape (hand, count, pitch_type, counter)"""
+    return np.stack([build_counter_tensor(df[df[column] == hand], pitch_types) for hand in HANDS])
+
+def build_matchup_matrix(pitcher_dfs, batter_dfs, levels, min_pitches=10, pool=False):
+    """Score every pitcher x batter pair at once.
+
+    Like a specific-batter analyze, each pair scores the batter's counters against
+    the pitcher's throwing hand, restricted to pitch types the pitcher actually
+    throws to that side. pool adds the pitcher's counters against the batter's
+    side of the plate to the batter's, which favors the (usually larger) pitcher sample.
+    Returns (pitch_types, scores, pitches) with scores/pitches shaped
+    (pitcher, batter, count, pitch_type); ineligible cells are NaN."""
+    pitch_types = sorted(set().union(*(df['pitch_type'].dropna().unique() for df in pitcher_dfs)))
+
+    # (pitcher, stand, C, T, K) and (batter, p_throws, C, T, K)
+    pitcher_tensors = np.stack([hand_split_tensors(df, 'stand', pitch_types) for df in pitcher_dfs])
+    batter_tensors = np.stack([hand_split_tensors(df, 'p_throws', pitch_types) for df in batter_dfs])
+
+    throws = np.array([HANDS.index(dominant_value(df['p_throws'], 'R')) for df in pitcher_dfs])
+    # Side each batter hits from against LHP / RHP (switch hitters flip)
+    stands = np.array([
+        [HANDS.index(dominant_value(df.loc[df['p_throws'] == hand, 'stand'], dominant_value(df['stand'], 'R'))) for hand in HANDS]
+        for df in batter_dfs
+    ])
+
+    pitcher_view = pitcher_tensors[np.arange(len(pitcher_dfs))[:, None], stands[:, throws].T]
+    batter_view = batter_tensors[np.arange(len(batter_dfs))[None, :], throws[:, None]]
+    combined = pitcher_view + batter_view if pool else batter_view
+
+    levels = np.asarray(levels)
+    scores = np.empty(combined.shape[:-1])
+    for level in set(levels):
+        rows = levels == level
+        benchmarks = calculate_league_benchmarks(None, level)
+        scores[rows] = score_counters(combined[rows], benchmarks, level)
+
+    pitches = combined[..., COUNTER_INDEX['pitches']]
+    eligible = (pitcher_view[..., COUNTER_INDEX['pitches']] > 0) & (pitches >= min_pitches)
+    return pitch_types, np.where(eligible, scores, np.nan), pitches
+
+def summarize_matchups(scores):
+    """Best pitch per count and the mean best-pitch PER for each pair"""
+    filled = np.where(np.isnan(scores), -np.inf, scores)
+    best_type = filled.argmax(axis=-1)
+    best_score = np.take_along_axis(filled, best_type[..., None], axis=-1)[..., 0]
+    has_pitch = np.isfinite(best_score)
+    n_counts = has_pitch.sum(axis=-1)
+    pair_score = np.where(n_counts > 0, np.where(has_pitch, best_score, 0).sum(axis=-1) / np.maximum(n_counts, 1), np.nan)
+    return best_type, np.where(has_pitch, best_score, np.nan), pair_score
+
+# --- MiLB Upload Store ---
+# Statcast's per-pitch identity; files without it fall back to hashing the whole row
+PITCH_KEY_COLUMNS = ['game_pk', 'at_bat_number', 'pitch_number']
+MILB_REQUIRED_COLUMNS = ['pitch_type', 'description', 'balls', 'strikes', 'events']
+_upload_lock = threading.Lock()
+
+def upload_path(pitcher_id, suffix='.csv'):
+    """uploads/<id>.csv plus its sidecars: .manifest.json, .keys.npy, .aggregates.npz"""
+    return os.path.join(server.config['UPLOAD_FOLDER'], secure_filename(f'{pitcher_id}{suffix}'))
+
+def pitch_keys(df):
+    """uint64 dedupe key per row"""
+    if all(col in df.columns for col in PITCH_KEY_COLUMNS):
+        key_df = df[PITCH_KEY_COLUMNS].apply(lambda col: pd.to_numeric(col, errors='coerce').astype('Int64'))
+    else:
+        key_df = df
+    return pd.util.hash_pandas_object(key_df.astype(str), index=False).to_numpy()
+
+def merge_counter_tensors(pitch_types, counters, new_pitch_types, new_counters):
+    """Sum two (hand, count, pitch_type, counter) tensors over the union of their pitch types"""
+    merged_types = sorted(set(pitch_types) | set(new_pitch_types))
+    merged = np.zeros(counters.shape[:2] + (len(merged_types),) + counters.shape[3:])
+    merged[:, :, [merged_types.index(t) for t in pitch_types]] += counters
+    merged[:, :, [merged_types.index(t) for t in new_pitch_types]] += new_counters
+    return merged_types, merged
+
+def upload_counters(df):
+    pitch_types = sorted(df['pitch_type'].dropna().unique())
+    return pitch_types, hand_split_tensors(preprocess_all_metrics(df), 'stand', pitch_types)
+
+def _write_atomic(path, write):
+    tmp_path = path + '.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def save_upload_state(pitcher_id, manifest, keys, pitch_types, counters):
+    # np.save/np.savez append their extension unless handed a file object
+    def save_keys(path):
+        with open(path, 'wb') as f:
+            np.save(f, keys)
+
+    def save_counters(path):
+        with open(path, 'wb') as f:
+            np.savez(f, counters=counters, pitch_types=np.array(pitch_types, dtype=str))
+
+    def save_manifest(path):
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    _write_atomic(upload_path(pitcher_id, '.keys.npy'), save_keys)
+    _write_atomic(upload_path(pitcher_id, '.aggregates.npz'), save_counters)
+    manifest['csv_bytes'] = os.path.getsize(upload_path(pitcher_id))
+    _write_atomic(upload_path(pitcher_id, '.manifest.json'), save_manifest)
+
+def load_upload_manifest(pitcher_id):
+    """Manifest of the files behind uploads/<id>.csv, or None if the CSV changed outside the upload route"""
+    manifest_path, csv_path = upload_path(pitcher_id, '.manifest.json'), upload_path(pitcher_id)
+    if not os.path.exists(manifest_path) or not os.path.exists(csv_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('csv_bytes') != os.path.getsize(csv_path):
+        return None
+    return manifest
+
+def rebuild_upload_state(pitcher_id, df, files):
+    """Recompute keys and aggregates from the full CSV contents"""
+    keys = np.unique(pitch_keys(df))
+    pitch_types, counters = upload_counters(df)
+    manifest = {'pitcher_id': str(pitcher_id), 'columns': list(df.columns), 'total_rows': len(df), 'files': files}
+    save_upload_state(pitcher_id, manifest, keys, pitch_types, counters)
+    return manifest
+
+@lru_cache(maxsize=20)
+def _read_upload_aggregates(path, modified_time):
+    with np.load(path) as stored:
+        return stored['pitch_types'].tolist(), stored['counters']
+
+def load_upload_aggregates(pitcher_id):
+    """Stored per-hand counter tensor for an uploaded pitcher, or None if it is missing or out of date"""
+    manifest = load_upload_manifest(pitcher_id)
+    path = upload_path(pitcher_id, '.aggregates.npz')
+    if manifest is None or not os.path.exists(path):
+        return None
+    pitch_types, counters = _read_upload_aggregates(path, os.path.getmtime(path))
+    return {'pitch_types': pitch_types, 'counters': counters, 'total_rows': manifest['total_rows']}
+
+def ingest_milb_upload(pitcher_id, df, raw_bytes, filename, mode='replace'):
+    """Store an uploaded MiLB CSV and keep its keys, aggregates and manifest in step.
+
+    replace overwrites uploads/<id>.csv. append de-duplicates the file against the
+    stored pitch keys, appends only the new rows and adds their counters to the
+    stored aggregates, so the cost scales with the uploaded file."""
+    csv_path = upload_path(pitcher_id)
+    entry = {
+        'filename': filename,
+        'sha256': hashlib.sha256(raw_bytes).hexdigest(),
+        'ingested_at': datetime.now().isoformat(timespec='seconds'),
+        'mode': mode,
+        'rows': len(df)
+    }
+
+    with _upload_lock:
+        if mode == 'replace' or not os.path.exists(csv_path):
+            with open(csv_path, 'wb') as f:
+                f.write(raw_bytes)
+            entry.update(new_rows=len(df), duplicate_rows=0)
+            manifest = rebuild_upload_state(pitcher_id, df, [entry])
+            return {'new_rows': len(df), 'duplicate_rows': 0, 'total_rows': manifest['total_rows']}
+
+        manifest = load_upload_manifest(pitcher_id)
+        if manifest is None:
+            # Uploaded before manifests existed (or edited by hand): index it once
+            manifest = rebuild_upload_state(pitcher_id, pd.read_csv(csv_path), [])
+
+        if any(f['sha256'] == entry['sha256'] for f in manifest['files']):
+            return {'new_rows': 0, 'duplicate_rows': len(df), 'total_rows': manifest['total_rows'], 'already_ingested': True}
+
+        # Stored rows keep the original column layout
+        df = df.reindex(columns=manifest['columns'])
+        keys = np.load(upload_path(pitcher_id, '.keys.npy'))
+        new_keys = pitch_keys(df)
+        _, first = np.unique(new_keys, return_index=True)
+        fresh = np.zeros(len(df), dtype=bool)
+        fresh[first] = True
+        fresh &= ~np.isin(new_keys, keys)
+        new_df = df[fresh]
+
+        stored = load_upload_aggregates(pitcher_id)
+        pitch_types, counters = merge_counter_tensors(stored['pitch_types'], stored['counters'], *upload_counters(new_df))
+        if not new_df.empty:
+            new_df.to_csv(csv_path, mode='a', header=False, index=False)
+
+        entry.update(new_rows=int(fresh.sum()), duplicate_rows=int(len(df) - fresh.sum()))
+        manifest['files'].append(entry)
+        manifest['total_rows'] += entry['new_rows']
+        save_upload_state(pitcher_id, manifest, np.union1d(keys, new_keys[fresh]), pitch_types, counters)
+        return {'new_rows': entry['new_rows'], 'duplicate_rows': entry['duplicate_rows'], 'total_rows': manifest['total_rows']}
+
+# --- Response Serialization ---
+COLUMNAR_MIMETYPE = 'application/vnd.pitchengine.columnar+json'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+COMPRESSION_MIN_BYTES = 1024
+
+# field -> numpy dtype (None for string fields)
+RECOMMENDATION_FIELDS = {
+    'pitch_type': None,
+    'count': None,
+    'score': np.float64,
+    'pitches': np.int64,
+    'whiff_rate': np.float64,
+    'hard_hit_rate': np.float64,
+    'called_strike_rate': np.float64,
+    'weak_contact_rate': np.float64,
+    'chase_rate': np.float64
+}
+
+def report_columns(report_df, fields=RECOMMENDATION_FIELDS):
+    """Pull each report field out as a numpy array (strings as lists)"""
+    columns = {}
+    for field, dtype in fields.items():
+        if field not in report_df.columns:
+            columns[field] = np.zeros(len(report_df), dtype=dtype or np.float64)
+        elif dtype is None:
+            columns[field] = report_df[field].astype(str).tolist()
+        else:
+            columns[field] = report_df[field].to_numpy(dtype=dtype)
+    return columns
+
+def columns_to_rows(columns):
+    """Row-of-objects view of a columnar table"""
+    names = list(columns)
+    values = [col.tolist() if isinstance(col, np.ndarray) else col for col in columns.values()]
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+def encode_json(payload):
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=_json_default).encode('utf-8')
+
+def encode_arrow(payload, table_key):
+    """Arrow IPC stream of the table; the remaining fields ride along as schema metadata"""
+    table = pa.table({name: pa.array(col) for name, col in payload[table_key].items()})
+    metadata = {k: v for k, v in payload.items() if k != table_key}
+    table = table.replace_schema_metadata({'metadata': encode_json(metadata)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def negotiate_response_format():
+    """Pick json (rows), columnar or arrow from ?format= or the Accept header"""
+    requested = request.args.get('format', '').lower()
+    if requested in ('json', 'columnar', 'arrow'):
+        return requested
+    best = request.accept_mimetypes.best_match(['application/json', COLUMNAR_MIMETYPE, ARROW_MIMETYPE])
+    if best == COLUMNAR_MIMETYPE:
+        return 'columnar'
+    if best == ARROW_MIMETYPE:
+        return 'arrow'
+    return 'json'
+
+def compressed_response(body, mimetype, status=200):
+    """Wrap an encoded body, applying brotli/gzip when the client accepts it"""
+    encoding = None
+    if len(body) >= COMPRESSION_MIN_BYTES:
+        if BROTLI_AVAILABLE and request.accept_encodings['br']:
+            body, encoding = brotli.compress(body, quality=5), 'br'
+        elif request.accept_encodings['gzip']:
+            body, encoding = gzip.compress(body, compresslevel=5), 'gzip'
+    response = Response(body, status=status, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
+
+def table_response(payload, table_key='recommendations'):
+    """Serialize a payload whose table_key holds a columnar table in the negotiated format"""
+    response_format = negotiate_response_format()
+    if response_format == 'arrow':
+        if not PYARROW_AVAILABLE:
+            return jsonify({'error': 'Arrow format requires pyarrow'}), 406
+        return compressed_response(encode_arrow(payload, table_key), ARROW_MIMETYPE)
+    if response_format == 'columnar':
+        return compressed_response(encode_json(payload), COLUMNAR_MIMETYPE)
+    rows = dict(payload, **{table_key: columns_to_rows(payload[table_key])})
+    return compressed_response(encode_json(rows), 'application/json')
+
+# --- Bulk Export ---
+EXPORT_MIMETYPES = {
+    'arrow': ARROW_MIMETYPE,
+    'parquet': 'application/vnd.apache.parquet',
+    'ndjson': 'application/x-ndjson'
+}
+EXPORT_EXTENSIONS = {'arrow': 'arrows', 'parquet': 'parquet', 'ndjson': 'ndjson'}
+EXPORT_CHUNK_ROWS = 50000
+# Object columns are typed from this many non-null values instead of the whole column
+SCHEMA_SAMPLE_ROWS = 1000
+
+class ChunkSink:
+    """Write-only file object that hands back whatever the Arrow writers wrote since the last drain"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+def export_schema(frame, columns):
+    """Arrow schema fixed up front so every chunk is written with the same types"""
+    fields = []
+    for column in columns:
+        values = frame[column]
+        if values.dtype != object:
+            arrow_type = pa.Schema.from_pandas(values.iloc[:0].to_frame(), preserve_index=False).field(column).type
+        else:
+            sample = values.dropna().iloc[:SCHEMA_SAMPLE_ROWS]
+            try:
+                arrow_type = pa.array(sample, from_pandas=True).type if len(sample) else pa.string()
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                arrow_type = pa.string()
+            if pa.types.is_null(arrow_type):
+                arrow_type = pa.string()
+        fields.append(pa.field(column, arrow_type))
+    return pa.schema(fields)
+
+def frame_chunks(parts, columns, chunk_rows):
+    """Selected rows of each (frame, positions) part, chunk_rows at a time, part by part"""
+    for frame, positions in parts:
+        column_idx = [frame.columns.get_loc(column) for column in columns]
+        for start in range(0, len(positions), chunk_rows):
+            yield frame.iloc[positions[start:start + chunk_rows], column_idx]
+
+def export_chunks(parts, columns, export_format, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield the selected rows of each (frame, positions) part as encoded bytes, one chunk of rows at a time.
+
+    Only chunk_rows rows of one part are materialized at once: Arrow IPC gets one
+    record batch per chunk, Parquet one row group per chunk, NDJSON one block of lines."""
+    if export_format == 'ndjson':
+        for chunk in frame_chunks(parts, columns, chunk_rows):
+            yield chunk.to_json(orient='records', lines=True, date_format='iso').encode('utf-8')
+        return
+
+    # One schema for every part, sampled from the head of each
+    schema = export_schema(pd.concat([frame[columns].iloc[:SCHEMA_SAMPLE_ROWS] for frame, _ in parts], ignore_index=True), columns)
+    sink = ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema) if export_format == 'arrow' else pq.ParquetWriter(sink, schema)
+    for chunk in frame_chunks(parts, columns, chunk_rows):
+        table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False, safe=False)
+        writer.write_table(table)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+# --- Request Profiling ---
+# ?profile=collapsed|speedscope (or an X-Profile header) runs any route under a stack sampler.
+# Only allowed with an X-Profile-Token header matching PROFILE_TOKEN (disabled when unset).
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_SECONDS', 0.005))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))  # newest profiles kept in PROFILE_DIR
+PROFILE_FORMATS = {'collapsed': ('text/plain', 'txt'), 'speedscope': ('application/json', 'speedscope.json')}
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+class StackSampler:
+    """Samples the Python stacks of one request thread on a background thread.
+
+    Pool worker threads busy with a task are sampled too, rooted at their thread
+    name, so fetches and season aggregations handed to executors still show up
+    (under concurrent load they can include other requests' work)."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _run(self):
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self._thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                if thread_id != self.thread_id:
+                    if not any(name == 'run' and filename.endswith(os.path.join('concurrent', 'futures', 'thread.py')) for name, filename, _ in stack):
+                        continue  # idle or unrelated thread
+                    if thread_id not in names:
+                        names[thread_id] = next((t.name for t in threading.enumerate() if t.ident == thread_id), str(thread_id))
+                    stack.insert(0, (names[thread_id], '', 0))
+                stack = tuple(stack)
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def collapsed(self):
+        """Brendan Gregg collapsed stacks: 'root;...;leaf count' per line"""
+        lines = []
+        for stack, samples in sorted(self.stacks.items()):
+            frames = ';'.join(f'{name} ({os.path.basename(filename)}:{line})' if filename else name for name, filename, line in stack)
+            lines.append(f'{frames} {samples}')
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self, name):
+        """speedscope 'sampled' profile with one weight (seconds) per distinct stack"""
+        frame_ids, frames, samples, weights = {}, [], [], []
+        for stack, count in self.stacks.items():
+            sample = []
+            for frame in stack:
+                if frame not in frame_ids:
+                    frame_ids[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]} if frame[1] else {'name': frame[0]})
+                sample.append(frame_ids[frame])
+            samples.append(sample)
+            weights.append(count * self.interval)
+        return {
+            '$schema': SPEEDSCOPE_SCHEMA,
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled', 'name': name, 'unit': 'seconds',
+                'startValue': 0, 'endValue': sum(weights),
+                'samples': samples, 'weights': weights
+            }],
+            'name': name,
+            'exporter': 'webpitchengine'
+        }
+
+def requested_profile_format():
+    return request.args.get('profile') or request.headers.get('X-Profile')
+
+def profiling_authorized():
+    token = request.headers.get('X-Profile-Token')
+    return bool(PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN))
+
+def store_profile(body, extension):
+    """Write a profile to PROFILE_DIR, dropping the oldest beyond PROFILE_KEEP; returns its file name"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    file_name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{request.endpoint}.{extension}"
+    with open(os.path.join(PROFILE_DIR, file_name), 'wb') as f:
+        f.write(body)
+    # Names start with the timestamp, so they sort oldest first
+    for old_name in sorted(os.listdir(PROFILE_DIR))[:-PROFILE_KEEP or None]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, old_name))
+        except FileNotFoundError:
+            pass  # removed by a concurrent request
+    return file_name
+
+@server.before_request
+def profile_request():
+    """Run the matched view under a StackSampler and answer with its profile.
+
+    The view's body is drained inside the sampling window, so streamed routes
+    and response encoding are included. The profile is also written to
+    PROFILE_DIR (newest PROFILE_KEEP only); the view's own status is kept in X-Profiled-Status."""
+    profile_format = requested_profile_format()
+    if not profile_format or request.endpoint is None:
+        return None
+    if profile_format not in PROFILE_FORMATS:
+        return jsonify({'error': f'profile must be one of {list(PROFILE_FORMATS)}'}), 400
+    if not profiling_authorized():
+        return jsonify({'error': 'Profiling is not authorized'}), 403
+
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    try:
+        response = server.make_response(server.dispatch_request())
+        response.get_data()
+    finally:
+        sampler.stop()
+
+    name = f'{request.method} {request.path} ({sampler.elapsed * 1000:.0f} ms)'
+    if profile_format == 'collapsed':
+        body = sampler.collapsed().encode('utf-8')
+    else:
+        body = encode_json(sampler.speedscope(name))
+    mimetype, extension = PROFILE_FORMATS[profile_format]
+    file_name = store_profile(body, extension)
+
+    profile = Response(body, mimetype=mimetype)
+    profile.headers['X-Profiled-Status'] = str(response.status_code)
+    profile.headers['X-Profile-Elapsed-Ms'] = f'{sampler.elapsed * 1000:.1f}'
+    profile.headers['X-Profile-File'] = file_name
+    return profile
+
 # --- API Routes ---
 @server.route('/api/pitchers/<league>')
 def get_pitchers(league):
@@ -505,9 +2006,499 @@ def get_pitchers(league):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def prepare_analysis(data):
+    """Load and slice the data behind an analyze request.
+
+    Returns (analysis, None) or (None, (message, status)). The analysis holds
+    either a counter tensor with its pitch types (Statcast seasons summed from
+    their partitions, stored MiLB aggregates or situational filters) or the
+    opponent-view frame of an uploaded file still to be scored."""
+    pitcher_id = data.get('pitcher_id')
+    years = data.get('years', [])
+    opponent_type = data.get('opponent_type', 'average')
+    batter_name = data.get('batter_name', '')
+    handedness = data.get('handedness', 'R')
+    filters = data.get('filters') or {}
+
+    if not pitcher_id or not years:
+        return None, ('Missing required parameters', 400)
+    
+    pitcher_name = ID_TO_NAME_MAP.get(pitcher_id)
+    if not pitcher_name:
+        return None, ('Pitcher not found', 404)
+    
+    pitcher_info = PUSH_PERFORMANCE_PITCHERS.get(pitcher_name, {})
+    pitcher_level = pitcher_info.get('level', 'MLB')
+    years_tuple = tuple(sorted(years))
+    analysis = {
+        'pitcher_name': pitcher_name,
+        'league': pitcher_level,
+        'sources': [] if pitcher_level == 'MiLB' else [(pitcher_id, years_tuple, 'pitcher')]
+    }
+
+    # Uploaded MiLB files keep running aggregates, so the unfiltered
+    # average-batter view does not need to re-read the CSV
+    stored = None
+    if pitcher_level == 'MiLB' and opponent_type != 'specific' and not filters and handedness in HANDS:
+        stored = load_upload_aggregates(pitcher_id)
+    
+    if stored is not None:
+        analysis['total_pitches'] = stored['total_rows']
+    elif pitcher_level != 'MiLB':
+        # Statcast seasons are aggregated per season and summed, never concatenated
+        pitcher_index = get_partitioned_index(pitcher_id, years_tuple, 'pitcher')
+        if pitcher_index.size == 0:
+            return None, (f'No data found for {pitcher_name}', 404)
+        analysis['total_pitches'] = pitcher_index.size
+        pitcher_hand = pitcher_index.column('p_throws').iloc[0]
+    else:
+        # Get pitcher data from the uploaded CSV
+        pitcher_df = load_pitcher_frame(pitcher_id, pitcher_level, years)
+        if pitcher_df is None:
+            return None, (f'MiLB data file not found for {pitcher_name}', 404)
+
+        if pitcher_df.empty:
+            return None, (f'No data found for {pitcher_name}', 404)
+        
+        pitcher_df = preprocess_all_metrics(pitcher_df)
+        analysis['total_pitches'] = int(pitcher_df.shape[0])
+        pitcher_hand = pitcher_df['p_throws'].iloc[0]
+    
+    # Generate analysis based on opponent type
+    if opponent_type == 'specific':
+        if not batter_name:
+            return None, ('Batter name required for specific analysis', 400)
+        
+        batter_id, error_msg = get_batter_id(batter_name)
+        if error_msg:
+            return None, (f'Batter lookup failed: {error_msg}', 400)
+        
+        # Get batter data
+        batter_index = get_partitioned_index(batter_id, years_tuple, 'batter')
+        analysis['sources'].append((batter_id, years_tuple, 'batter'))
+        if batter_index.size == 0:
+            return None, (f'No batter data found for {batter_name}', 404)
+        
+        analysis['opponent_name'] = batter_name.title()
+        filter_index, filter_hand = batter_index, pitcher_hand
+    else:
+        analysis['opponent_name'] = f"Avg {handedness}HH Batter"
+        if stored is None and handedness not in HANDS:
+            return None, (f'handedness must be one of {HANDS}', 400)
+        if pitcher_level != 'MiLB':
+            filter_index, filter_hand = pitcher_index, handedness
+        elif filters:
+            filter_index, filter_hand = load_pitcher_index(pitcher_id, pitcher_level, years), handedness
+        elif stored is None:
+            analysis['frame'] = pitcher_df[pitcher_df['stand'] == handedness].copy().reset_index(drop=True)
+
+    if stored is not None:
+        analysis['counters'] = stored['counters'][HANDS.index(handedness)]
+        analysis['pitch_types'] = stored['pitch_types']
+    elif 'frame' not in analysis:
+        # Cached indexes resolve the opponent view and any situational filters straight to counters
+        try:
+            analysis['counters'] = filter_index.aggregate(filter_hand, filters)
+        except ValueError as e:
+            return None, (f'Invalid filters: {e}', 400)
+        analysis['pitch_types'] = filter_index.pitch_types
+    return analysis, None
+
 @server.route('/api/analyze', methods=['POST'])
 def analyze_pitcher():
     """Generate pitch recommendation analysis"""
+    try:
+        data = request.get_json()
+        years = data.get('years', [])
+        min_pitches = data.get('min_pitches', 10)
+        filters = data.get('filters') or {}
+        confidence_level = data.get('confidence_level', 0.9)
+        bootstrap_samples = data.get('bootstrap_samples', BOOTSTRAP_SAMPLES)
+
+        if not 0 < confidence_level < 1 or not 0 < bootstrap_samples <= 20000:
+            return jsonify({'error': 'confidence_level must be in (0, 1) and bootstrap_samples in (0, 20000]'}), 400
+
+        analysis, error = prepare_analysis(data)
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+        pitcher_level = analysis['league']
+
+        # Calculate league benchmarks
+        league_benchmarks = calculate_league_benchmarks(None, pitcher_level)
+
+        if 'counters' in analysis:
+            report_df = report_from_counters(analysis['counters'], analysis['pitch_types'], league_benchmarks, pitcher_level, min_pitches)
+        else:
+            # Ensure all derived columns are present before scoring
+            analysis_df = preprocess_all_metrics(analysis['frame'])
+            # Cast all boolean columns used in aggregation/division to int
+            for col in ['whiff', 'swing', 'chase', 'out_of_zone', 'is_weak_contact', 'is_hard_hit', 'bip', 'is_called_strike']:
+                if col in analysis_df.columns:
+                    analysis_df[col] = analysis_df[col].astype(int)
+            analysis_df = add_rate_columns(analysis_df)
+
+            # Generate recommendations
+            report_df = generate_recommendation_report(analysis_df, min_pitches, league_benchmarks, pitcher_level)
+        
+        if report_df.empty:
+            return jsonify({'error': 'Not enough data to generate recommendations'}), 400
+
+        # Confidence intervals come from resampling the aggregated counters
+        report_df = report_df.assign(**bootstrap_intervals(report_df, league_benchmarks, pitcher_level, confidence_level, bootstrap_samples))
+        
+        result = {
+            'pitcher_name': analysis['pitcher_name'],
+            'opponent_name': analysis['opponent_name'],
+            'years': years,
+            'league': pitcher_level,
+            'total_pitches': analysis['total_pitches'],
+            'filters': filters,
+            'confidence_level': confidence_level,
+            'data_freshness': data_freshness(analysis['sources']),
+            'recommendations': report_columns(report_df, {**RECOMMENDATION_FIELDS, **INTERVAL_FIELDS})
+        }
+
+        # Rows by default; columnar JSON or Arrow IPC when negotiated
+        return table_response(result)
+        
+    except UpstreamUnavailable as e:
+        return jsonify({'error': f'Statcast unavailable: {e}'}), 503
+    except Exception as e:
+        print(f"Analysis error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def stream_event(name, payload, sse=False):
+    """One NDJSON line, or one server-sent event when sse is set"""
+    if sse:
+        return f'event: {name}\ndata: '.encode('utf-8') + encode_json(payload) + b'\n\n'
+    return encode_json({'event': name, **payload}) + b'\n'
+
+@server.route('/api/analyze/stream', methods=['POST'])
+def analyze_pitcher_stream():
+    """Analyze, streamed as loaded -> one event per count -> summary (NDJSON, or SSE when asked)"""
+    data = request.get_json() or {}
+    years = data.get('years', [])
+    min_pitches = data.get('min_pitches', 10)
+    filters = data.get('filters') or {}
+    confidence_level = data.get('confidence_level', 0.9)
+    bootstrap_samples = data.get('bootstrap_samples', BOOTSTRAP_SAMPLES)
+
+    if not data.get('pitcher_id') or not years:
+        return jsonify({'error': 'Missing required parameters'}), 400
+    if data.get('pitcher_id') not in ID_TO_NAME_MAP:
+        return jsonify({'error': 'Pitcher not found'}), 404
+    if not 0 < confidence_level < 1 or not 0 < bootstrap_samples <= 20000:
+        return jsonify({'error': 'confidence_level must be in (0, 1) and bootstrap_samples in (0, 20000]'}), 400
+
+    sse = request.args.get('format') == 'sse' or request.accept_mimetypes.best_match(['application/x-ndjson', 'text/event-stream']) == 'text/event-stream'
+
+    def generate():
+        started = time.time()
+        elapsed_ms = lambda: int((time.time() - started) * 1000)
+        try:
+            analysis, error = prepare_analysis(data)
+            if error:
+                yield stream_event('error', {'error': error[0], 'status': error[1]}, sse)
+                return
+            league = analysis['league']
+            benchmarks = calculate_league_benchmarks(None, league)
+            if 'counters' in analysis:
+                counters, pitch_types = analysis['counters'], analysis['pitch_types']
+            else:
+                frame = preprocess_all_metrics(analysis['frame'])
+                pitch_types = sorted(frame['pitch_type'].dropna().unique())
+                counters = build_counter_tensor(frame, pitch_types)
+
+            yield stream_event('loaded', {
+                'pitcher_name': analysis['pitcher_name'],
+                'opponent_name': analysis['opponent_name'],
+                'years': years,
+                'league': league,
+                'total_pitches': analysis['total_pitches'],
+                'filters': filters,
+                'confidence_level': confidence_level,
+                'data_freshness': data_freshness(analysis['sources']),
+                'elapsed_ms': elapsed_ms()
+            }, sse)
+
+            scores = score_counters(counters, benchmarks, league)
+            rates = counter_rates(counters)
+            best = []
+            for c, count_str in enumerate(COUNT_ORDER):
+                report = count_report(counters, scores, rates, pitch_types, c, min_pitches)
+                rows = []
+                if report is not None:
+                    report = report.assign(**bootstrap_intervals(report, benchmarks, league, confidence_level, bootstrap_samples))
+                    rows = columns_to_rows(report_columns(report, {**RECOMMENDATION_FIELDS, **INTERVAL_FIELDS}))
+                    best.append(rows[0])
+                yield stream_event('count', {'count': count_str, 'recommendations': rows, 'elapsed_ms': elapsed_ms()}, sse)
+
+            if not best:
+                yield stream_event('error', {'error': 'Not enough data to generate recommendations', 'status': 400}, sse)
+                return
+            top = max(best, key=lambda row: row['score'])
+            yield stream_event('summary', {
+                'counts_with_recommendations': len(best),
+                'average_best_score': float(np.mean([row['score'] for row in best])),
+                'best': {'count': top['count'], 'pitch_type': top['pitch_type'], 'score': top['score']},
+                'elapsed_ms': elapsed_ms()
+            }, sse)
+
+        except UpstreamUnavailable as e:
+            yield stream_event('error', {'error': f'Statcast unavailable: {e}', 'status': 503}, sse)
+        except Exception as e:
+            print(f"Analysis stream error: {e}")
+            yield stream_event('error', {'error': str(e), 'status': 500}, sse)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream' if sse else 'application/x-ndjson')
+    # Keep proxies from buffering the stream
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@server.route('/api/matchup-matrix', methods=['POST'])
+def matchup_matrix():
+    """Score a pitching staff against a lineup and rank every matchup"""
+    try:
+        data = request.get_json()
+        pitcher_ids = data.get('pitcher_ids', [])
+        batter_names = data.get('batter_names', [])
+        years = data.get('years', [])
+        min_pitches = data.get('min_pitches', 10)
+        pool_pitcher_data = bool(data.get('pool_pitcher_data', False))
+
+        if not pitcher_ids or not batter_names or not years:
+            return jsonify({'error': 'Missing required parameters'}), 400
+
+        unknown = [pid for pid in pitcher_ids if pid not in ID_TO_NAME_MAP]
+        if unknown:
+            return jsonify({'error': f'Pitchers not found: {unknown}'}), 404
+
+        years_tuple = tuple(sorted(years))
+
+        sources = []
+        upstream_errors = {}
+
+        def fetch_pitcher(pitcher_id):
+            level = PUSH_PERFORMANCE_PITCHERS[ID_TO_NAME_MAP[pitcher_id]]['level']
+            try:
+                df = load_pitcher_frame(pitcher_id, level, years)
+            except UpstreamUnavailable as e:
+                upstream_errors[ID_TO_NAME_MAP[pitcher_id]] = f'Statcast unavailable: {e}'
+                return None
+            if level != 'MiLB':
+                sources.append((pitcher_id, years_tuple, 'pitcher'))
+            return df
+
+        def fetch_batter(batter_name):
+            try:
+                batter_id, error_msg = get_batter_id(batter_name)
+                if error_msg:
+                    return None
+                df = get_statcast_data(batter_id, years_tuple, 'batter')
+            except UpstreamUnavailable as e:
+                upstream_errors[batter_name] = f'Statcast unavailable: {e}'
+                return None
+            sources.append((batter_id, years_tuple, 'batter'))
+            return df
+
+        # Upstream fetches are I/O bound, so pull the whole staff and lineup concurrently
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            pitcher_results = list(pool.map(fetch_pitcher, pitcher_ids))
+            batter_results = list(pool.map(fetch_batter, batter_names))
+
+        errors = {}
+        pitchers, pitcher_dfs = [], []
+        for pitcher_id, df in zip(pitcher_ids, pitcher_results):
+            name = ID_TO_NAME_MAP[pitcher_id]
+            if df is None or df.empty:
+                errors[name] = upstream_errors.get(name, 'No pitcher data found')
+                continue
+            df = preprocess_all_metrics(df)
+            pitchers.append({'id': pitcher_id, 'name': name, 'level': PUSH_PERFORMANCE_PITCHERS[name]['level'], 'throws': dominant_value(df['p_throws'], 'R')})
+            pitcher_dfs.append(df)
+
+        batters, batter_dfs = [], []
+        for batter_name, df in zip(batter_names, batter_results):
+            if df is None or df.empty:
+                errors[batter_name] = upstream_errors.get(batter_name, 'No batter data found')
+                continue
+            batters.append({'name': batter_name.title()})
+            batter_dfs.append(df)
+
+        if not pitcher_dfs or not batter_dfs:
+            # Missing data caused by an outage is a 503, not a 404
+            return jsonify({'error': 'Not enough data to build a matchup matrix', 'details': errors}), 503 if upstream_errors else 404
+
+        pitch_types, scores, pitches = build_matchup_matrix(pitcher_dfs, batter_dfs, [p['level'] for p in pitchers], min_pitches, pool_pitcher_data)
+        best_type, best_score, pair_score = summarize_matchups(scores)
+
+        rankings = []
+        for p, b in zip(*np.nonzero(~np.isnan(pair_score))):
+            best_pitches = {}
+            for c, count_str in enumerate(COUNT_ORDER):
+                if np.isnan(best_score[p, b, c]):
+                    continue
+                t = best_type[p, b, c]
+                best_pitches[count_str] = {
+                    'pitch_type': pitch_types[t],
+                    'score': float(round(best_score[p, b, c], 1)),
+                    'pitches': int(pitches[p, b, c, t])
+                }
+            rankings.append({
+                'pitcher_id': pitchers[p]['id'],
+                'pitcher_name': pitchers[p]['name'],
+                'batter_name': batters[b]['name'],
+                'score': float(round(pair_score[p, b], 1)),
+                'best_pitches': best_pitches
+            })
+        rankings.sort(key=lambda r: r['score'], reverse=True)
+
+        result = {
+            'years': years,
+            'pool_pitcher_data': pool_pitcher_data,
+            'pitchers': pitchers,
+            'batters': batters,
+            'matrix': [[None if np.isnan(s) else float(round(s, 1)) for s in row] for row in pair_score],
+            'rankings': rankings,
+            'errors': errors,
+            'data_freshness': data_freshness(sources)
+        }
+        return jsonify(result)
+
+    except Exception as e:
+        print(f"Matchup matrix error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@server.route('/api/trend', methods=['POST'])
+def pitch_trend():
+    """Rolling-window PER trend lines for each pitch type and count"""
+    try:
+        data = request.get_json()
+        pitcher_id = data.get('pitcher_id')
+        years = data.get('years', [])
+        handedness = data.get('handedness', 'R')
+        min_pitches = data.get('min_pitches', 10)
+        window_days = data.get('window_days')
+        window_pitches = data.get('window_pitches', 250)
+        filters = data.get('filters') or {}
+
+        if not pitcher_id or not years:
+            return jsonify({'error': 'Missing required parameters'}), 400
+
+        if handedness not in HANDS:
+            return jsonify({'error': f'handedness must be one of {HANDS}'}), 400
+        window_name, window = ('window_days', window_days) if window_days is not None else ('window_pitches', window_pitches)
+        if isinstance(window, bool) or not isinstance(window, int) or window <= 0:
+            return jsonify({'error': f'{window_name} must be a positive integer'}), 400
+
+        pitcher_name = ID_TO_NAME_MAP.get(pitcher_id)
+        if not pitcher_name:
+            return jsonify({'error': 'Pitcher not found'}), 404
+
+        pitcher_level = PUSH_PERFORMANCE_PITCHERS[pitcher_name]['level']
+        index = load_pitcher_index(pitcher_id, pitcher_level, years)
+        if index is None:
+            return jsonify({'error': f'MiLB data file not found for {pitcher_name}'}), 404
+        if index.size == 0:
+            return jsonify({'error': f'No data found for {pitcher_name}'}), 404
+        if not index.has_dates:
+            return jsonify({'error': 'Trend analysis requires game_date in the data'}), 400
+
+        try:
+            counts, type_codes, values, dates = index.rows(handedness, filters)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid filters: {e}'}), 400
+
+        game_days, windows = rolling_counters(dates, counts, type_codes, values, len(index.pitch_types), window_days=window_days, window_pitches=window_pitches)
+        if len(game_days) == 0:
+            return jsonify({'error': f'No data found for {pitcher_name}'}), 404
+
+        benchmarks = calculate_league_benchmarks(None, pitcher_level)
+        result = {
+            'pitcher_name': pitcher_name,
+            'opponent_name': f"Avg {handedness}HH Batter",
+            'years': years,
+            'league': pitcher_level,
+            'window': {'days': window_days} if window_days else {'pitches': window_pitches},
+            'filters': filters,
+            'data_freshness': data_freshness([] if pitcher_level == 'MiLB' else [(pitcher_id, tuple(sorted(years)), 'pitcher')]),
+            'trend': trend_columns(game_days, windows, index.pitch_types, benchmarks, pitcher_level, min_pitches)
+        }
+        return table_response(result, table_key='trend')
+
+    except UpstreamUnavailable as e:
+        return jsonify({'error': f'Statcast unavailable: {e}'}), 503
+    except Exception as e:
+        print(f"Trend error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@server.route('/api/sequencing', methods=['POST'])
+def pitch_sequencing():
+    """Best follow-up pitches for each previous pitch and count"""
+    try:
+        data = request.get_json()
+        pitcher_id = data.get('pitcher_id')
+        years = data.get('years', [])
+        handedness = data.get('handedness', 'R')
+        min_pitches = data.get('min_pitches', 10)
+        top_n = data.get('top_n', 3)
+        previous_pitch_type = data.get('previous_pitch_type')
+        filters = data.get('filters') or {}
+
+        if not pitcher_id or not years:
+            return jsonify({'error': 'Missing required parameters'}), 400
+
+        if handedness not in HANDS:
+            return jsonify({'error': f'handedness must be one of {HANDS}'}), 400
+        if isinstance(top_n, bool) or not isinstance(top_n, int) or top_n <= 0:
+            return jsonify({'error': 'top_n must be a positive integer'}), 400
+
+        pitcher_name = ID_TO_NAME_MAP.get(pitcher_id)
+        if not pitcher_name:
+            return jsonify({'error': 'Pitcher not found'}), 404
+
+        pitcher_level = PUSH_PERFORMANCE_PITCHERS[pitcher_name]['level']
+        index = load_pitcher_index(pitcher_id, pitcher_level, years)
+        if index is None:
+            return jsonify({'error': f'MiLB data file not found for {pitcher_name}'}), 404
+        if not index.pitch_types:
+            return jsonify({'error': f'No data found for {pitcher_name}'}), 404
+        missing = [col for col in PITCH_KEY_COLUMNS if col not in index.columns]
+        if missing:
+            return jsonify({'error': f'Sequencing needs {missing} to order pitches within plate appearances'}), 400
+
+        try:
+            counters = index.sequence_counters(handedness, filters)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid filters: {e}'}), 400
+
+        if previous_pitch_type:
+            wanted = [previous_pitch_type] if isinstance(previous_pitch_type, str) else previous_pitch_type
+            counters[[pitch_type not in wanted for pitch_type in index.pitch_types]] = 0
+
+        benchmarks = calculate_league_benchmarks(None, pitcher_level)
+        sequences = sequence_columns(counters, index.pitch_types, benchmarks, pitcher_level, min_pitches, top_n)
+        result = {
+            'pitcher_name': pitcher_name,
+            'opponent_name': f"Avg {handedness}HH Batter",
+            'years': years,
+            'league': pitcher_level,
+            'filters': filters,
+            'data_freshness': data_freshness([] if pitcher_level == 'MiLB' else [(pitcher_id, tuple(sorted(years)), 'pitcher')]),
+            'sequences': sequences
+        }
+        return table_response(result, table_key='sequences')
+
+    except UpstreamUnavailable as e:
+        return jsonify({'error': f'Statcast unavailable: {e}'}), 503
+    except Exception as e:
+        print(f"Sequencing error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@server.route('/api/heatmap', methods=['POST'])
+def location_heatmap():
+    """Location grids per pitch type and count: frequency, rates and PER per cell"""
     try:
         data = request.get_json()
         pitcher_id = data.get('pitcher_id')
@@ -515,112 +2506,214 @@ def analyze_pitcher():
         opponent_type = data.get('opponent_type', 'average')
         batter_name = data.get('batter_name', '')
         handedness = data.get('handedness', 'R')
-        min_pitches = data.get('min_pitches', 10)
-        
+        min_pitches = data.get('min_pitches', 1)
+        pitch_types = data.get('pitch_types')
+        counts = data.get('counts')
+        filters = data.get('filters') or {}
+
         if not pitcher_id or not years:
             return jsonify({'error': 'Missing required parameters'}), 400
-        
+
         pitcher_name = ID_TO_NAME_MAP.get(pitcher_id)
         if not pitcher_name:
             return jsonify({'error': 'Pitcher not found'}), 404
-        
-        pitcher_info = PUSH_PERFORMANCE_PITCHERS.get(pitcher_name, {})
-        pitcher_level = pitcher_info.get('level', 'MLB')
-        
-        # Get pitcher data
-        if pitcher_level == 'MiLB':
-            # Load from CSV file
-            csv_path = os.path.join(server.config['UPLOAD_FOLDER'], f'{pitcher_id}.csv')
-            if not os.path.exists(csv_path):
-                return jsonify({'error': f'MiLB data file not found for {pitcher_name}'}), 404
-            pitcher_df = pd.read_csv(csv_path)
-        else:
-            # Get MLB data from pybaseball
-            pitcher_df = get_statcast_data(pitcher_id, tuple(sorted(years)), 'pitcher')
-        
-        if pitcher_df.empty:
+
+        pitcher_level = PUSH_PERFORMANCE_PITCHERS[pitcher_name]['level']
+        index = load_pitcher_index(pitcher_id, pitcher_level, years)
+        if index is None:
+            return jsonify({'error': f'MiLB data file not found for {pitcher_name}'}), 404
+        if index.size == 0:
             return jsonify({'error': f'No data found for {pitcher_name}'}), 404
-        
-        pitcher_df = preprocess_all_metrics(pitcher_df)
-        
-        # Generate analysis based on opponent type
+        sources = [] if pitcher_level == 'MiLB' else [(pitcher_id, tuple(sorted(years)), 'pitcher')]
+
+        # Same opponent views as analyze: the batter's pitches against this pitcher's hand,
+        # or the pitcher's pitches against one side of the plate
         if opponent_type == 'specific':
             if not batter_name:
                 return jsonify({'error': 'Batter name required for specific analysis'}), 400
-            
             batter_id, error_msg = get_batter_id(batter_name)
             if error_msg:
                 return jsonify({'error': f'Batter lookup failed: {error_msg}'}), 400
-            
-            # Get batter data
-            batter_df = get_statcast_data(batter_id, tuple(sorted(years)), 'batter')
-            if batter_df.empty:
+            hand = dominant_value(index.column('p_throws'), 'R')
+            index = get_partitioned_index(batter_id, tuple(sorted(years)), 'batter')
+            sources.append((batter_id, tuple(sorted(years)), 'batter'))
+            if index.size == 0:
                 return jsonify({'error': f'No batter data found for {batter_name}'}), 404
-            
-            pitcher_hand = pitcher_df['p_throws'].iloc[0]
-            analysis_df = batter_df[batter_df['p_throws'] == pitcher_hand].copy().reset_index(drop=True)
             opponent_name = batter_name.title()
-        else:
-            analysis_df = pitcher_df[pitcher_df['stand'] == handedness].copy().reset_index(drop=True)
+        elif handedness in HANDS:
+            hand = handedness
             opponent_name = f"Avg {handedness}HH Batter"
+        else:
+            return jsonify({'error': f'handedness must be one of {HANDS}'}), 400
 
-        # Ensure all derived columns are present before scoring
-        analysis_df = preprocess_all_metrics(analysis_df)
-        # Cast all boolean columns used in aggregation/division to int
-        for col in ['whiff', 'swing', 'chase', 'out_of_zone', 'is_weak_contact', 'is_hard_hit', 'bip', 'is_called_strike']:
-            if col in analysis_df.columns:
-                analysis_df[col] = analysis_df[col].astype(int)
-        analysis_df = add_rate_columns(analysis_df)
+        try:
+            counters = index.location_counters(hand, filters)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid filters: {e}'}), 400
 
-        # Calculate league benchmarks from the data
-        league_benchmarks = calculate_league_benchmarks(analysis_df, pitcher_level)
-        
-        # Generate recommendations
-        report_df = generate_recommendation_report(analysis_df, min_pitches, league_benchmarks, pitcher_level)
-        
-        if report_df.empty:
-            return jsonify({'error': 'Not enough data to generate recommendations'}), 400
-        
-        # Convert to JSON-serializable format
-        recommendations = []
-        for _, row in report_df.iterrows():
-            rec = {
-                'pitch_type': row['pitch_type'],
-                'count': row['count'],
-                'score': float(row['score']),
-                'pitches': int(row['pitches']),
-                'whiff_rate': float(row['whiff_rate']),
-                'hard_hit_rate': float(row['hard_hit_rate']),
-                'called_strike_rate': float(row['called_strike_rate']),
-                'weak_contact_rate': float(row.get('weak_contact_rate', 0)),
-                'chase_rate': float(row.get('chase_rate', 0))
-            }
-            recommendations.append(rec)
-        
+        # Narrow to the requested pitch types / counts before scoring
+        type_rows = [i for i, pitch_type in enumerate(index.pitch_types) if not pitch_types or pitch_type in pitch_types]
+        counters = counters[:, type_rows]
+        if counts:
+            counters[[count_str not in counts for count_str in COUNT_ORDER]] = 0
+
+        benchmarks = calculate_league_benchmarks(None, pitcher_level)
         result = {
             'pitcher_name': pitcher_name,
             'opponent_name': opponent_name,
             'years': years,
             'league': pitcher_level,
-            'total_pitches': int(pitcher_df.shape[0]),
-            'recommendations': recommendations
+            'filters': filters,
+            'x_edges': HEATMAP_X_EDGES.tolist(),
+            'z_edges': HEATMAP_Z_EDGES.tolist(),
+            'data_freshness': data_freshness(sources),
+            'cells': heatmap_columns(counters, [index.pitch_types[i] for i in type_rows], benchmarks, pitcher_level, min_pitches)
+        }
+        return table_response(result, table_key='cells')
+
+    except UpstreamUnavailable as e:
+        return jsonify({'error': f'Statcast unavailable: {e}'}), 503
+    except Exception as e:
+        print(f"Heatmap error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@server.route('/api/similar-pitchers', methods=['POST'])
+def similar_pitchers():
+    """League pitchers whose arsenal is closest to a roster pitcher's"""
+    try:
+        data = request.get_json()
+        pitcher_id = data.get('pitcher_id')
+        years = data.get('years', [])
+        k = data.get('k', 10)
+
+        if not pitcher_id or not years:
+            return jsonify({'error': 'Missing required parameters'}), 400
+
+        if ARSENAL_INDEX is None:
+            return jsonify({'error': 'Arsenal index not built; run build_arsenal_index.py'}), 503
+
+        if not 0 < k <= 100:
+            return jsonify({'error': 'k must be in (0, 100]'}), 400
+
+        pitcher_name = ID_TO_NAME_MAP.get(pitcher_id)
+        if not pitcher_name:
+            return jsonify({'error': 'Pitcher not found'}), 404
+
+        pitcher_level = PUSH_PERFORMANCE_PITCHERS[pitcher_name]['level']
+        pitcher_df = load_pitcher_frame(pitcher_id, pitcher_level, years)
+        if pitcher_df is None:
+            return jsonify({'error': f'MiLB data file not found for {pitcher_name}'}), 404
+        if pitcher_df.empty:
+            return jsonify({'error': f'No data found for {pitcher_name}'}), 404
+
+        # PER features must be on the pool's scale, so score with the index's league, not the pitcher's
+        pitcher_df = preprocess_all_metrics(pitcher_df).assign(pitcher=pitcher_id)
+        index_league = ARSENAL_INDEX['league']
+        _, features = arsenal_features(pitcher_df, calculate_league_benchmarks(None, index_league), index_league)
+        n_types = len(ARSENAL_PITCH_TYPES)
+        usage = features[0, :n_types]
+        if not usage.any():
+            return jsonify({'error': f'{pitcher_name} throws none of the pitch types {ARSENAL_PITCH_TYPES}'}), 400
+        vector = normalize_arsenal(features, ARSENAL_INDEX['means'], ARSENAL_INDEX['stds'])[0]
+        top, similarity = nearest_arsenals(vector, k, exclude_id=pitcher_id)
+
+        result = {
+            'pitcher_name': pitcher_name,
+            'league': pitcher_level,
+            'years': years,
+            'index_version': ARSENAL_INDEX['version'],
+            'index_league': ARSENAL_INDEX['league'],
+            'arsenal': {pitch_type: float(round(share, 3)) for pitch_type, share in zip(ARSENAL_PITCH_TYPES, usage) if share > 0},
+            'similar': [
+                {
+                    'pitcher_id': int(ARSENAL_INDEX['pitcher_ids'][i]),
+                    'name': str(ARSENAL_INDEX['names'][i]),
+                    'similarity': float(round(similarity[i], 4))
+                }
+                for i in top
+            ]
         }
-        
         return jsonify(result)
-        
+
+    except UpstreamUnavailable as e:
+        return jsonify({'error': f'Statcast unavailable: {e}'}), 503
     except Exception as e:
-        print(f"Analysis error: {e}")
+        print(f"Similarity error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@server.route('/api/export', methods=['POST'])
+def export_pitches():
+    """Stream a player's processed pitches as Arrow IPC, Parquet or NDJSON"""
+    try:
+        data = request.get_json()
+        pitcher_id = data.get('pitcher_id')
+        batter_name = data.get('batter_name', '')
+        years = data.get('years', [])
+        export_format = data.get('format', 'arrow')
+        columns = data.get('columns')
+        handedness = data.get('handedness')
+        filters = data.get('filters') or {}
+
+        if (not pitcher_id and not batter_name) or not years:
+            return jsonify({'error': 'Missing required parameters'}), 400
+
+        if export_format not in EXPORT_MIMETYPES:
+            return jsonify({'error': f'format must be one of {list(EXPORT_MIMETYPES)}'}), 400
+        if export_format != 'ndjson' and not PYARROW_AVAILABLE:
+            return jsonify({'error': f'{export_format} export requires pyarrow'}), 406
+
+        if handedness and handedness not in HANDS:
+            return jsonify({'error': f'handedness must be one of {HANDS}'}), 400
+
+        if pitcher_id:
+            player_name = ID_TO_NAME_MAP.get(pitcher_id)
+            if not player_name:
+                return jsonify({'error': 'Pitcher not found'}), 404
+            index = load_pitcher_index(pitcher_id, PUSH_PERFORMANCE_PITCHERS[player_name]['level'], years)
+            if index is None:
+                return jsonify({'error': f'MiLB data file not found for {player_name}'}), 404
+        else:
+            batter_id, error_msg = get_batter_id(batter_name)
+            if error_msg:
+                return jsonify({'error': f'Batter lookup failed: {error_msg}'}), 400
+            player_name = batter_name.title()
+            index = get_partitioned_index(batter_id, tuple(sorted(years)), 'batter')
+
+        if index.size == 0:
+            return jsonify({'error': f'No data found for {player_name}'}), 404
+
+        columns = columns or index.columns
+        unknown = [column for column in columns if column not in index.columns]
+        if unknown:
+            return jsonify({'error': f'Unknown columns: {unknown}'}), 400
+
+        try:
+            parts = index.export_parts([handedness] if handedness else HANDS, filters)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid filters: {e}'}), 400
+
+        filename = secure_filename(f"{player_name}_{'_'.join(map(str, sorted(years)))}.{EXPORT_EXTENSIONS[export_format]}")
+        response = Response(export_chunks(parts, columns, export_format), mimetype=EXPORT_MIMETYPES[export_format])
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        response.headers['X-Row-Count'] = str(sum(len(positions) for _, positions in parts))
+        return response
+
+    except UpstreamUnavailable as e:
+        return jsonify({'error': f'Statcast unavailable: {e}'}), 503
+    except Exception as e:
+        print(f"Export error: {e}")
         return jsonify({'error': str(e)}), 500
 
 @server.route('/api/upload-milb', methods=['POST'])
 def upload_milb_data():
-    """Upload MiLB CSV data for a pitcher"""
+    """Upload MiLB CSV data for a pitcher (mode=replace, or mode=append for per-game files)"""
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
         
         file = request.files['file']
         pitcher_id = request.form.get('pitcher_id')
+        mode = request.form.get('mode', 'replace')
         
         if not pitcher_id:
             return jsonify({'error': 'Pitcher ID required'}), 400
@@ -630,38 +2723,43 @@ def upload_milb_data():
         
         if not file.filename.endswith('.csv'):
             return jsonify({'error': 'Only CSV files allowed'}), 400
+
+        if mode not in ('replace', 'append'):
+            return jsonify({'error': "mode must be 'replace' or 'append'"}), 400
         
-        # Save file
-        filename = secure_filename(f'{pitcher_id}.csv')
-        filepath = os.path.join(server.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
-        # Validate CSV structure
+        # Validate CSV structure before anything is written
+        raw_bytes = file.read()
         try:
-            df = pd.read_csv(filepath)
-            required_columns = ['pitch_type', 'description', 'balls', 'strikes', 'events']
-            missing_columns = [col for col in required_columns if col not in df.columns]
+            df = pd.read_csv(io.BytesIO(raw_bytes))
+            missing_columns = [col for col in MILB_REQUIRED_COLUMNS if col not in df.columns]
             if missing_columns:
-                os.remove(filepath)
                 return jsonify({'error': f'Missing required columns: {missing_columns}'}), 400
         except Exception as e:
-            os.remove(filepath)
             return jsonify({'error': f'Invalid CSV file: {str(e)}'}), 400
-        
-        return jsonify({'message': 'MiLB data uploaded successfully', 'pitcher_id': pitcher_id})
+
+        summary = ingest_milb_upload(pitcher_id, df, raw_bytes, file.filename, mode)
+        return jsonify({'message': 'MiLB data uploaded successfully', 'pitcher_id': pitcher_id, 'mode': mode, **summary})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@server.route('/api/upload-milb/<pitcher_id>/manifest')
+def upload_manifest(pitcher_id):
+    """Files ingested into a pitcher's MiLB data"""
+    manifest = load_upload_manifest(pitcher_id)
+    if manifest is None:
+        return jsonify({'error': 'No upload manifest for this pitcher'}), 404
+    return jsonify(manifest)
+
 @server.route('/')
 def root():
     """Root endpoint"""
-    return jsonify({'message': 'WebPitchEngine API is running', 'status': 'healthy', 'endpoints': ['/api/health', '/api/pitchers/<league>', '/api/analyze', '/api/upload-milb']})
+    return jsonify({'message': 'WebPitchEngine API is running', 'status': 'healthy', 'endpoints': ['/api/health', '/api/pitchers/<league>', '/api/analyze', '/api/analyze/stream', '/api/matchup-matrix', '/api/trend', '/api/sequencing', '/api/heatmap', '/api/similar-pitchers', '/api/export', '/api/upload-milb']})
 
 @server.route('/api/health')
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'pybaseball_available': PYBASEBALL_AVAILABLE})
+    return jsonify({'status': 'healthy', 'pybaseball_available': PYBASEBALL_AVAILABLE, 'count_weights_version': COUNT_WEIGHTS_VERSION, 'arsenal_index_version': ARSENAL_INDEX['version'] if ARSENAL_INDEX else None, 'statcast_circuit': statcast_breaker.state})
 
 def keep_alive():
     """Keep the server alive by pinging itself every 10 minutes"""
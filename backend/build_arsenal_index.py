@@ -0,0 +1,66 @@
+"""
+Arsenal Index Builder
+Builds the league pitcher pool that /api/similar-pitchers searches
+"""
+
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+from app import (ARSENAL_COLUMNS, arsenal_feature_names, arsenal_features, calculate_league_benchmarks,
+                 normalize_arsenal, preprocess_all_metrics)
+from refit_count_weights import load_pitch_store
+
+def build_index(store_path, league='MLB', min_pitches=300):
+    df = load_pitch_store(store_path, ARSENAL_COLUMNS)
+    missing = [col for col in ('pitcher', 'pitch_type', 'balls', 'strikes') if col not in df.columns]
+    if missing:
+        raise ValueError(f"Pitch store is missing {missing}")
+    print(f"Total pitches loaded: {len(df)}")
+
+    # Keep pitchers with enough pitches for stable usage and PER features
+    totals = df['pitcher'].value_counts()
+    df = df[df['pitcher'].isin(totals.index[totals >= min_pitches])].reset_index(drop=True)
+    print(f"Pitchers with at least {min_pitches} pitches: {df['pitcher'].nunique()}")
+
+    df = preprocess_all_metrics(df)
+    pitcher_ids, features = arsenal_features(df, calculate_league_benchmarks(None, league), league)
+
+    # Pool statistics over observed values; features nobody has get mean 0 / std 0
+    observed = np.isfinite(features)
+    n_observed = np.maximum(observed.sum(axis=0), 1)
+    means = np.where(observed, features, 0).sum(axis=0) / n_observed
+    stds = np.sqrt((np.where(observed, features - means, 0) ** 2).sum(axis=0) / n_observed)
+
+    if 'player_name' in df.columns:
+        names = df.groupby('pitcher')['player_name'].first().reindex(pitcher_ids).fillna('').to_numpy(dtype=str)
+    else:
+        names = pitcher_ids.astype(str)
+
+    return {
+        'pitcher_ids': pitcher_ids.astype(np.int64),
+        'names': names,
+        'matrix': normalize_arsenal(features, means, stds),
+        'means': means,
+        'stds': stds,
+        'feature_names': np.array(arsenal_feature_names())
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the arsenal similarity index from a league-wide pitch store")
+    parser.add_argument('store', help="CSV/Parquet file or directory of league-wide Statcast pitches")
+    parser.add_argument('--league', default='MLB', help="Benchmarks used for the PER features (default: MLB)")
+    parser.add_argument('--min-pitches', type=int, default=300, help="Minimum pitches for a pitcher to enter the pool")
+    parser.add_argument('--version', default=datetime.now().strftime('%Y%m%d-%H%M%S'), help="Version label stored in the index")
+    parser.add_argument('--output', default='arsenal_index.npz', help="Index file app.py loads (ARSENAL_INDEX_FILE)")
+    args = parser.parse_args()
+
+    print("=== Arsenal Index Build ===\n")
+    index = build_index(args.store, args.league, args.min_pitches)
+    np.savez(args.output, version=np.array(args.version), league=np.array(args.league), **index)
+    print(f"\nSaved {len(index['pitcher_ids'])} pitchers x {index['matrix'].shape[1]} features to {args.output}")
+    print("\n=== Build Complete ===")
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,21 @@ League Averages Research Script
 Professional baseball analytics - League average calculations
 """
 
+import argparse
+import glob
+import hashlib
+import os
+from datetime import datetime
+
 import pandas as pd
 import numpy as np
 from pybaseball import statcast_pitcher, statcast_batter, pitching_stats, chadwick_register
 import requests
 import json
 
+# Outcome sums per pitch type; they add up across pitchers, so each pitcher is aggregated once
+COUNTER_COLUMNS = ['pitches', 'whiff', 'swing', 'chase', 'out_of_zone', 'is_weak_contact', 'is_hard_hit', 'bip', 'is_called_strike']
+
 def add_pitch_event_columns(df):
     swing_descriptions = [
         'foul', 'foul_tip', 'hit_into_play', 'swinging_strike', 'swinging_strike_blocked', 'foul_bunt'
@@ -159,27 +168,27 @@ def preprocess_statcast_data(df):
     
     return df
 
-def calculate_pitch_type_averages(df, min_pitches=100):
-    """Calculate league averages by pitch type"""
-    # First, let's see what columns we actually have
-    print(f"Available columns: {list(df.columns)}")
-    
+def pitch_type_counters(df):
+    """Per-pitch-type outcome sums of a preprocessed frame"""
+    if df.empty:
+        return pd.DataFrame(columns=['pitch_type'] + COUNTER_COLUMNS)
+
     # Create a count column if it doesn't exist
     if 'pitches' not in df.columns:
         df['pitches'] = 1  # Each row represents one pitch
     
-    # Group by pitch type and calculate metrics
-    pitch_stats = df.groupby('pitch_type').agg({
-        'pitches': 'sum',  # Changed from 'count' to 'sum'
-        'whiff': 'sum',
-        'swing': 'sum',
-        'chase': 'sum',
-        'out_of_zone': 'sum',
-        'is_weak_contact': 'sum',
-        'is_hard_hit': 'sum',
-        'bip': 'sum',
-        'is_called_strike': 'sum'
-    }).reset_index()
+    # Group by pitch type and sum outcomes
+    return df.groupby('pitch_type')[COUNTER_COLUMNS].sum().reset_index()
+
+def calculate_pitch_type_averages(df, min_pitches=100):
+    """Calculate league averages by pitch type"""
+    # First, let's see what columns we actually have
+    print(f"Available columns: {list(df.columns)}")
+    return league_averages_from_counters(pitch_type_counters(df), min_pitches)
+
+def league_averages_from_counters(pitch_stats, min_pitches=100):
+    """League average distributions from per-pitch-type outcome sums"""
+    pitch_stats = pitch_stats.copy()
     
     # Filter for sufficient sample size
     pitch_stats = pitch_stats[pitch_stats['pitches'] >= min_pitches]
@@ -256,9 +265,10 @@ def calculate_pitch_type_averages(df, min_pitches=100):
     
     return league_averages
 
-def get_top_mlb_pitchers(year=2024, min_innings=50):
+def get_top_mlb_pitchers(year=2024, min_innings=50, fallback=True):
     """
-    Get a comprehensive list of MLB pitchers for league averages using MLBAM IDs
+    Get a comprehensive list of MLB pitchers for league averages using MLBAM IDs.
+    With fallback=False a failed leaderboard fetch raises instead of returning the manual list.
     """
     try:
         print(f"Fetching {year} pitching leaders...")
@@ -274,6 +284,8 @@ def get_top_mlb_pitchers(year=2024, min_innings=50):
         return pitcher_ids[:50]  # Limit for performance
     except Exception as e:
         print(f"Error fetching pitcher list: {e}")
+        if not fallback:
+            raise
         # Fallback to manual list
         return [
             676979, 657277, 592332, 607200, 656731, 681432, 663559,
@@ -352,35 +364,187 @@ def create_custom_scoring_model():
     
     return run_values
 
+# --- Checkpointed Research Runs ---
+RESEARCH_STORE = 'research_store'
+LEVELS = ['mlb', 'milb']
+
+def _write_json_atomic(path, payload):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def season_pitchers(level, year, upload_dir):
+    """Pitchers to sample for one season: the MLB leaderboard (raises if it cannot be fetched), or every uploaded MiLB file"""
+    if level == 'mlb':
+        return list(dict.fromkeys(get_top_mlb_pitchers(year, fallback=False)))
+    files = glob.glob(os.path.join(upload_dir, '*.csv'))
+    return sorted(os.path.basename(path)[:-len('.csv')] for path in files)
+
+def pitcher_source(level, pitcher_id, upload_dir):
+    """Version of a pitcher's source data: None for Statcast, a hash of the uploaded file for MiLB"""
+    if level == 'mlb':
+        return None
+    digest = hashlib.sha256()
+    with open(os.path.join(upload_dir, f'{pitcher_id}.csv'), 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+def fetch_pitcher_season(level, year, pitcher_id, upload_dir):
+    if level == 'mlb':
+        return statcast_pitcher(f'{year}-03-01', f'{year}-11-30', pitcher_id)
+    df = pd.read_csv(os.path.join(upload_dir, f'{pitcher_id}.csv'), low_memory=False)
+    if 'game_date' in df.columns:
+        df = df[pd.to_datetime(df['game_date'], errors='coerce').dt.year == int(year)]
+    return df
+
+def checkpoint_season(store, level, year, upload_dir='uploads'):
+    """Fetch and aggregate every pitcher of a season that is not checkpointed yet.
+
+    Layout under <store>/<level>/<year>/:
+      pitchers.json          the season's pitcher list
+      raw/<id>[-<hash>].csv.gz  each pitcher's fetched pitches
+      counters/<id>.csv      their per-pitch-type outcome sums
+      progress.json          pitcher -> pitch total and source, written after both files
+    The MLB list is saved once the leaderboard was really fetched; MiLB uploads
+    are re-listed every run and keyed on a hash of the file, so new and
+    appended uploads are picked up. A pitcher that fails (network error,
+    timeout) is left out of progress.json and retried on the next run.
+    """
+    season_dir = os.path.join(store, level, str(year))
+    os.makedirs(os.path.join(season_dir, 'raw'), exist_ok=True)
+    os.makedirs(os.path.join(season_dir, 'counters'), exist_ok=True)
+
+    pitchers_path = os.path.join(season_dir, 'pitchers.json')
+    pitchers = _read_json(pitchers_path, None) if level == 'mlb' else None
+    if pitchers is None:
+        pitchers = season_pitchers(level, year, upload_dir)
+        _write_json_atomic(pitchers_path, pitchers)
+
+    progress_path = os.path.join(season_dir, 'progress.json')
+    progress = _read_json(progress_path, {})
+    sources = {str(pitcher_id): pitcher_source(level, pitcher_id, upload_dir) for pitcher_id in pitchers}
+    todo = [pitcher_id for pitcher_id in pitchers
+            if progress.get(str(pitcher_id), {'source': 'missing'}).get('source') != sources[str(pitcher_id)]]
+    print(f"{level.upper()} {year}: {len(pitchers) - len(todo)} of {len(pitchers)} pitchers already checkpointed")
+
+    for i, pitcher_id in enumerate(todo):
+        source = sources[str(pitcher_id)]
+        raw_name = f'{pitcher_id}.csv.gz' if source is None else f'{pitcher_id}-{source}.csv.gz'
+        raw_path = os.path.join(season_dir, 'raw', raw_name)
+        try:
+            if os.path.exists(raw_path):
+                df = pd.read_csv(raw_path, low_memory=False)
+            else:
+                print(f"Fetching data for pitcher {i+1}/{len(todo)} (ID: {pitcher_id})")
+                df = fetch_pitcher_season(level, year, pitcher_id, upload_dir)
+                df.to_csv(raw_path + '.tmp', index=False, compression='gzip')
+                os.replace(raw_path + '.tmp', raw_path)
+        except Exception as e:
+            print(f"✗ Error with pitcher {pitcher_id}, will retry on the next run: {e}")
+            continue
+
+        counters = pitch_type_counters(add_pitch_event_columns(preprocess_statcast_data(df)) if not df.empty else df)
+        counters.to_csv(os.path.join(season_dir, 'counters', f'{pitcher_id}.csv'), index=False)
+        progress[str(pitcher_id)] = {'pitches': len(df), 'source': source, 'completed': datetime.now().isoformat(timespec='seconds')}
+        _write_json_atomic(progress_path, progress)
+        # Raw checkpoints of earlier versions of the upload are superseded
+        for stale_path in glob.glob(os.path.join(season_dir, 'raw', f'{pitcher_id}-*.csv.gz')):
+            if stale_path != raw_path:
+                os.remove(stale_path)
+        print(f"✓ Checkpointed {len(df)} pitches from pitcher {pitcher_id}")
+
+    return season_dir, pitchers, sources, progress
+
+def build_season_artifact(store, level, year, min_pitches=50, output_dir='.', version=None, upload_dir='uploads'):
+    """Checkpoint a season and write league_averages_<level>_<year>.json from the stored counters.
+
+    The artifact is only recomputed when the set of eligible pitchers, their
+    source versions or min_pitches changed; its .meta.json sidecar records
+    version and provenance."""
+    season_dir, pitchers, sources, progress = checkpoint_season(store, level, year, upload_dir)
+    done = [str(p) for p in pitchers if progress.get(str(p), {'source': 'missing'}).get('source') == sources[str(p)]]
+    eligible = sorted(p for p in done if progress[p]['pitches'] >= min_pitches)
+    if not eligible:
+        print(f"No eligible pitchers for {level.upper()} {year}")
+        return None
+
+    fingerprint = hashlib.sha256(json.dumps({'pitchers': {p: sources[p] for p in eligible}, 'min_pitches': min_pitches}, sort_keys=True).encode()).hexdigest()[:16]
+    artifact_path = os.path.join(output_dir, f'league_averages_{level}_{year}.json')
+    meta_path = os.path.join(output_dir, f'league_averages_{level}_{year}.meta.json')
+    meta = _read_json(meta_path, {})
+    if os.path.exists(artifact_path) and meta.get('fingerprint') == fingerprint:
+        print(f"{artifact_path} is up to date (version {meta.get('version')})")
+        return _read_json(artifact_path, None)
+
+    pitch_stats = pd.concat([pd.read_csv(os.path.join(season_dir, 'counters', f'{p}.csv')) for p in eligible], ignore_index=True)
+    pitch_stats = pitch_stats.groupby('pitch_type')[COUNTER_COLUMNS].sum().reset_index()
+    averages = league_averages_from_counters(pitch_stats, min_pitches)
+
+    _write_json_atomic(artifact_path, averages)
+    _write_json_atomic(meta_path, {
+        'version': version or datetime.now().strftime('%Y%m%d-%H%M%S'),
+        'fingerprint': fingerprint,
+        'level': level,
+        'year': year,
+        'min_pitches': min_pitches,
+        'pitchers': len(eligible),
+        'pitches': int(pitch_stats['pitches'].sum()),
+        'pitchers_missing': len(pitchers) - len(done),
+        'created': datetime.now().isoformat(timespec='seconds')
+    })
+    print(f"Saved to {artifact_path}")
+    return averages
+
 def main():
     """Main function to run league average research"""
+    parser = argparse.ArgumentParser(description="Checkpointed league average research")
+    parser.add_argument('--years', type=int, nargs='+', default=[2024], help="Seasons to build (default: 2024)")
+    parser.add_argument('--levels', nargs='+', choices=LEVELS, default=['mlb'], help="mlb uses Statcast, milb the uploaded CSVs")
+    parser.add_argument('--min-pitches', type=int, default=50, help="Minimum pitches per pitcher and per pitch type")
+    parser.add_argument('--store', default=RESEARCH_STORE, help="Checkpoint directory; rerun with the same store to resume")
+    parser.add_argument('--upload-dir', default='uploads', help="MiLB CSV directory")
+    parser.add_argument('--output-dir', default='.', help="Where league_averages_<level>_<year>.json is written")
+    parser.add_argument('--version', default=None, help="Version label recorded in each artifact's .meta.json")
+    args = parser.parse_args()
+
     print("=== League Averages Research ===\n")
     
-    # Get comprehensive Statcast-based averages
-    print("1. Calculating Comprehensive Statcast League Averages...")
-    print("This will fetch data from 50+ MLB pitchers for accurate averages\n")
-    
-    statcast_averages = get_statcast_league_averages_comprehensive(2024, min_pitches=50)
-    
-    if statcast_averages:
-        print("\nStatcast League Averages (2024):")
-        for metric, stats in statcast_averages.items():
-            print(f"\n{metric.upper()}:")
-            print(f"  Mean: {stats['mean']:.3f}")
-            print(f"  Std Dev: {stats['std']:.3f}")
-            print(f"  90th Percentile: {stats['p90']:.3f}")
-            print(f"  75th Percentile: {stats['p75']:.3f}")
-            print(f"  50th Percentile: {stats['p50']:.3f}")
-            print(f"  25th Percentile: {stats['p25']:.3f}")
-            print(f"  10th Percentile: {stats['p10']:.3f}")
-    
-    # Save to JSON for use in your app
-    if statcast_averages:
-        with open('league_averages_2024.json', 'w') as f:
-            json.dump(statcast_averages, f, indent=2)
-        print("\nSaved to league_averages_2024.json")
+    for level in args.levels:
+        for year in args.years:
+            try:
+                statcast_averages = build_season_artifact(args.store, level, year, args.min_pitches, args.output_dir, args.version, args.upload_dir)
+            except Exception as e:
+                print(f"✗ {level.upper()} {year} failed, will retry on the next run: {e}")
+                continue
+            if not statcast_averages:
+                continue
+
+            print(f"\n{level.upper()} League Averages ({year}):")
+            for metric, stats in statcast_averages.items():
+                print(f"\n{metric.upper()}:")
+                print(f"  Mean: {stats['mean']:.3f}")
+                print(f"  Std Dev: {stats['std']:.3f}")
+                print(f"  90th Percentile: {stats['p90']:.3f}")
+                print(f"  75th Percentile: {stats['p75']:.3f}")
+                print(f"  50th Percentile: {stats['p50']:.3f}")
+                print(f"  25th Percentile: {stats['p25']:.3f}")
+                print(f"  10th Percentile: {stats['p10']:.3f}")
+
+            # The app and guide read the original league_averages_<year>.json name for MLB
+            if level == 'mlb':
+                legacy_path = os.path.join(args.output_dir, f'league_averages_{year}.json')
+                _write_json_atomic(legacy_path, statcast_averages)
+                print(f"\nSaved to {legacy_path}")
     
     print("\n=== Research Complete ===")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,328 @@
+"""
+Load Testing Harness
+Boots the Flask server under gunicorn with a deterministic local stand-in for Statcast
+and reports throughput, latency percentiles, memory and error rates per configuration
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MLB_PITCHERS = [676979, 657277, 663559, 592332, 607200, 681432, 656731]
+MILB_PITCHERS = [681026, 676951, 693331, 656484, 687834]
+BATTERS = ['Aaron Judge', 'Juan Soto', 'Shohei Ohtani', 'Mookie Betts', 'Freddie Freeman', 'Jose Ramirez']
+
+PITCH_TYPES = ['FF', 'SI', 'SL', 'CH', 'CU', 'FC']
+DESCRIPTIONS = ['ball', 'called_strike', 'swinging_strike', 'foul', 'hit_into_play', 'swinging_strike_blocked', 'foul_tip', 'blocked_ball']
+DESCRIPTION_P = [0.35, 0.17, 0.11, 0.17, 0.15, 0.02, 0.01, 0.02]
+ZONES = [1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 12, 13, 14]
+
+# --- Deterministic Statcast Stand-in ---
+def synthetic_pitches(player_id, year, player_type, n_pitches=None):
+    """Statcast-shaped frame that is identical for the same (player, year, type)"""
+    seed = zlib.crc32(f'{player_id}-{year}-{player_type}'.encode())
+    rng = np.random.default_rng(seed)
+    n = n_pitches or int(rng.integers(2500, 3500))
+    n_games = 30
+
+    description = rng.choice(DESCRIPTIONS, n, p=DESCRIPTION_P)
+    in_play = description == 'hit_into_play'
+    games = np.sort(rng.integers(0, n_games, n))
+    at_bat = np.cumsum(rng.random(n) < 0.27)
+    p_throws = 'L' if player_id % 2 else 'R'
+
+    df = pd.DataFrame({
+        'pitch_type': rng.choice(PITCH_TYPES[:int(rng.integers(3, len(PITCH_TYPES) + 1))], n),
+        'game_date': pd.Timestamp(f'{year}-04-01') + pd.to_timedelta(games * 6, unit='D'),
+        'release_speed': rng.normal(91, 4, n).round(1),
+        'release_spin_rate': rng.normal(2300, 200, n).round(),
+        'pfx_x': rng.normal(0, 0.8, n).round(2),
+        'pfx_z': rng.normal(1, 0.5, n).round(2),
+        'plate_x': rng.normal(0, 0.9, n).round(2),
+        'plate_z': rng.normal(2.5, 0.9, n).round(2),
+        'zone': rng.choice(ZONES, n),
+        'description': description,
+        'events': np.where(in_play, rng.choice(['single', 'field_out', 'double', 'home_run'], n), None),
+        'balls': rng.integers(0, 4, n),
+        'strikes': rng.integers(0, 3, n),
+        'stand': rng.choice(['L', 'R'], n) if player_type == 'pitcher' else ('L' if player_id % 3 == 0 else 'R'),
+        'p_throws': p_throws if player_type == 'pitcher' else rng.choice(['L', 'R'], n, p=[0.3, 0.7]),
+        'launch_speed': np.where(in_play, rng.normal(88, 12, n), np.nan).round(1),
+        'woba_value': np.where(in_play, 0.9, 0.0),
+        'est_slg_g': 0.0,
+        'delta_run_exp': rng.normal(0, 0.1, n).round(3),
+        'game_type': 'R',
+        'game_pk': 700000 + games,
+        'at_bat_number': at_bat,
+        'inning': rng.integers(1, 10, n),
+        'outs_when_up': rng.integers(0, 3, n),
+        'on_1b': np.where(rng.random(n) < 0.3, 1.0, np.nan),
+        'on_2b': np.where(rng.random(n) < 0.2, 1.0, np.nan),
+        'on_3b': np.where(rng.random(n) < 0.1, 1.0, np.nan),
+        'n_thruorder_pitcher': rng.integers(1, 4, n),
+        'pitcher': player_id if player_type == 'pitcher' else rng.integers(400000, 700000, n),
+        'batter': player_id if player_type == 'batter' else rng.integers(400000, 700000, n)
+    })
+    df['pitch_number'] = df.groupby(['game_pk', 'at_bat_number']).cumcount() + 1
+    return df
+
+def stubbed_server():
+    """Gunicorn factory: the real Flask server with pybaseball swapped for the stand-in.
+
+    Configured through environment variables so every worker gets the same setup:
+    LOADTEST_UPSTREAM_LATENCY_MS (artificial delay per upstream call) and
+    LOADTEST_UPLOAD_DIR (folder holding the synthetic MiLB CSVs).
+    """
+    sys.path.insert(0, BACKEND_DIR)
+    import app
+
+    latency = float(os.environ.get('LOADTEST_UPSTREAM_LATENCY_MS', '0')) / 1000
+
+    def statcast_pitcher(start_dt, end_dt, player_id):
+        time.sleep(latency)
+        return synthetic_pitches(player_id, start_dt[:4], 'pitcher')
+
+    def statcast_batter(start_dt, end_dt, player_id):
+        time.sleep(latency)
+        return synthetic_pitches(player_id, start_dt[:4], 'batter')
+
+    def playerid_lookup(last, first):
+        time.sleep(latency)
+        return pd.DataFrame({'key_mlbam': [400000 + zlib.crc32(f'{first} {last}'.lower().encode()) % 300000]})
+
+    app.statcast_pitcher = statcast_pitcher
+    app.statcast_batter = statcast_batter
+    app.playerid_lookup = playerid_lookup
+    app.PYBASEBALL_AVAILABLE = True
+    app.server.config['UPLOAD_FOLDER'] = os.environ.get('LOADTEST_UPLOAD_DIR', app.server.config['UPLOAD_FOLDER'])
+    return app.server
+
+# --- Request Profiles ---
+def cold_request(rng):
+    """Random pitcher-season far outside the warm set, so the data cache misses"""
+    return {'pitcher_id': rng.choice(MLB_PITCHERS), 'years': [str(rng.randint(1900, 2099))], 'opponent_type': 'average', 'handedness': rng.choice(['L', 'R'])}
+
+def warm_request(rng):
+    return {'pitcher_id': rng.choice(MLB_PITCHERS[:2]), 'years': ['2024'], 'opponent_type': 'average', 'handedness': rng.choice(['L', 'R'])}
+
+def specific_request(rng):
+    return {'pitcher_id': rng.choice(MLB_PITCHERS[:2]), 'years': ['2024'], 'opponent_type': 'specific', 'batter_name': rng.choice(BATTERS)}
+
+def milb_request(rng):
+    return {'pitcher_id': rng.choice(MILB_PITCHERS), 'years': ['2024'], 'opponent_type': 'average', 'handedness': rng.choice(['L', 'R'])}
+
+PROFILES = {
+    'cold': cold_request,
+    'warm': warm_request,
+    'specific': specific_request,
+    'milb': milb_request
+}
+
+def parse_mix(mix):
+    """'warm=4,cold=1' -> {'warm': 4.0, 'cold': 1.0}"""
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name not in PROFILES:
+            raise ValueError(f"Unknown profile '{name}', expected one of {list(PROFILES)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+# --- Measurement ---
+def process_tree_rss(pid):
+    """Resident memory (MB) of a process and its children, read from /proc (Linux only)"""
+    if not os.path.isdir('/proc'):
+        return None
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+
+    total_kb, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, []))
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return total_kb / 1024
+
+def run_load(base_url, mix, concurrency, duration, seed):
+    """Closed-loop load: each client thread fires the next request as soon as the last one returns"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(client_id):
+        rng = random.Random(seed + client_id)
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            profile = rng.choices(names, weights)[0]
+            body = PROFILES[profile](rng)
+            start = time.perf_counter()
+            try:
+                response = session.post(f'{base_url}/api/analyze', json=body, timeout=120)
+                ok = response.status_code == 200
+                status = response.status_code
+            except requests.RequestException as e:
+                ok, status = False, type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                results.append((profile, elapsed, ok, status))
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - started
+
+def summarize(results, wall_time):
+    def stats(rows):
+        latencies = np.array([r[1] for r in rows]) * 1000
+        errors = [r for r in rows if not r[2]]
+        summary = {
+            'requests': len(rows),
+            'throughput_rps': round(len(rows) / wall_time, 2),
+            'error_rate': round(len(errors) / len(rows), 4) if rows else 0.0,
+            'errors': sorted({str(r[3]) for r in errors})
+        }
+        if len(rows):
+            for p in (50, 90, 95, 99):
+                summary[f'p{p}_ms'] = round(float(np.percentile(latencies, p)), 1)
+            summary['max_ms'] = round(float(latencies.max()), 1)
+        return summary
+
+    report = stats(results)
+    report['profiles'] = {name: stats([r for r in results if r[0] == name]) for name in sorted({r[0] for r in results})}
+    return report
+
+# --- Harness ---
+def write_milb_uploads(upload_dir):
+    for pitcher_id in MILB_PITCHERS:
+        synthetic_pitches(pitcher_id, 2024, 'pitcher').to_csv(os.path.join(upload_dir, f'{pitcher_id}.csv'), index=False)
+
+def wait_until_healthy(base_url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if requests.get(f'{base_url}/api/health', timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("Server did not become healthy in time")
+
+def run_configuration(workers, threads, args, upload_dir):
+    base_url = f'http://127.0.0.1:{args.port}'
+    env = dict(os.environ, LOADTEST_UPSTREAM_LATENCY_MS=str(args.latency_ms), LOADTEST_UPLOAD_DIR=upload_dir)
+    command = [
+        sys.executable, '-m', 'gunicorn',
+        '--workers', str(workers), '--threads', str(threads),
+        '--bind', f'127.0.0.1:{args.port}', '--timeout', '120',
+        'load_test:stubbed_server()'
+    ]
+    print(f"\n--- {workers} worker(s) x {threads} thread(s) ---")
+    server_log = open(os.path.join(upload_dir, f'server_{workers}x{threads}.log'), 'w')
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=server_log, stderr=subprocess.STDOUT)
+    try:
+        wait_until_healthy(base_url, process)
+        if args.warmup:
+            run_load(base_url, {'warm': 1, 'specific': 1, 'milb': 1}, args.concurrency, args.warmup, args.seed + 1000)
+
+        peak = {'rss_mb': process_tree_rss(process.pid)}
+        sampling = threading.Event()
+
+        def sample_memory():
+            while not sampling.is_set():
+                rss = process_tree_rss(process.pid)
+                if rss is not None:
+                    peak['rss_mb'] = max(peak['rss_mb'] or 0, rss)
+                sampling.wait(0.5)
+
+        sampler = threading.Thread(target=sample_memory, daemon=True)
+        sampler.start()
+        results, wall_time = run_load(base_url, args.mix, args.concurrency, args.duration, args.seed)
+        sampling.set()
+        sampler.join()
+
+        report = summarize(results, wall_time)
+        report.update({'workers': workers, 'threads': threads, 'peak_rss_mb': round(peak['rss_mb'], 1) if peak['rss_mb'] else None})
+        print(f"{report['requests']} requests, {report['throughput_rps']} req/s, "
+              f"p50 {report.get('p50_ms')} ms, p99 {report.get('p99_ms')} ms, "
+              f"errors {report['error_rate']:.2%}, peak RSS {report['peak_rss_mb']} MB")
+        return report
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        server_log.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/analyze against a stubbed Statcast source")
+    parser.add_argument('--configs', default='1x1,2x4', help="Comma-separated gunicorn WORKERSxTHREADS configurations")
+    parser.add_argument('--mix', default='warm=4,cold=1,specific=2,milb=1', help="Request profile weights")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent client threads")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds of measured load per configuration")
+    parser.add_argument('--warmup', type=float, default=5, help="Seconds of unmeasured warm-up load")
+    parser.add_argument('--latency-ms', type=float, default=200, help="Artificial latency per upstream Statcast call")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+    args.mix = parse_mix(args.mix)
+
+    print("=== Load Test ===")
+    print(f"Mix {args.mix}, concurrency {args.concurrency}, {args.duration}s per config, upstream latency {args.latency_ms} ms")
+
+    upload_dir = tempfile.mkdtemp(prefix='webpitchengine_loadtest_')
+    reports = []
+    try:
+        write_milb_uploads(upload_dir)
+        for config in args.configs.split(','):
+            workers, threads = (int(x) for x in config.lower().split('x'))
+            reports.append(run_configuration(workers, threads, args, upload_dir))
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': {k: v for k, v in vars(args).items()}, 'results': reports}, f, indent=2)
+        print(f"\nSaved to {args.output}")
+
+    print("\n=== Load Test Complete ===")
+
+if __name__ == "__main__":
+    main()
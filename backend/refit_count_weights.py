@@ -0,0 +1,159 @@
+"""
+Count Weights Refit Pipeline
+Recalibrates COUNT_WEIGHTS and COUNT_DIFFICULTY_MODIFIER from a league-wide pitch store
+"""
+
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from league_averages_research import preprocess_statcast_data
+
+COUNTS = ['0-0', '0-1', '0-2', '1-0', '1-1', '1-2', '2-0', '2-1', '2-2', '3-0', '3-1', '3-2']
+
+# COUNT_WEIGHTS key -> preprocessed outcome column
+OUTCOME_COLUMNS = {
+    'is_hard_hit': 'is_hard_hit',
+    'is_called_strike': 'is_called_strike',
+    'is_weak_contact': 'is_weak_contact',
+    'is_whiff': 'whiff',
+    'is_chase': 'chase'
+}
+
+STORE_COLUMNS = ['pitch_type', 'description', 'zone', 'launch_speed', 'balls', 'strikes', 'events', 'woba_value']
+
+# Difficulty modifiers are spread over this range, hardest count = 1.0
+MODIFIER_FLOOR = 0.8
+
+def load_pitch_store(path, columns):
+    """Read the given columns from a CSV/Parquet file or a directory of them"""
+    if os.path.isdir(path):
+        files = sorted(glob.glob(os.path.join(path, '**', '*.parquet'), recursive=True) +
+                       glob.glob(os.path.join(path, '**', '*.csv'), recursive=True))
+    else:
+        files = [path]
+    if not files:
+        raise FileNotFoundError(f"No pitch files found in {path}")
+
+    wanted = set(columns)
+    frames = []
+    for file in files:
+        if file.endswith('.parquet'):
+            df = pd.read_parquet(file)
+            df = df[[col for col in df.columns if col in wanted]]
+        else:
+            df = pd.read_csv(file, usecols=lambda col: col in wanted)
+        frames.append(df)
+        print(f"Loaded {len(df)} pitches from {file}")
+    return pd.concat(frames, ignore_index=True)
+
+def split_by_count(df, target):
+    """One (count, outcome matrix, run value vector) task per ball-strike count"""
+    df = preprocess_statcast_data(df)
+    df['count'] = df['balls'].astype(int).astype(str) + '-' + df['strikes'].astype(int).astype(str)
+    df[target] = pd.to_numeric(df[target], errors='coerce')
+    df = df[df[target].notna()]
+
+    tasks = []
+    for count_str, count_df in df.groupby('count'):
+        if count_str not in COUNTS:
+            continue
+        X = count_df[list(OUTCOME_COLUMNS.values())].to_numpy(dtype=float)
+        y = count_df[target].to_numpy(dtype=float)
+        tasks.append((count_str, X, y))
+    return tasks
+
+def fit_count(task):
+    """Per-count outcome importance from a least-squares fit of run value on the outcomes.
+
+    Importance is the absolute standardized coefficient (|beta| * std(outcome)),
+    normalized so the five weights sum to 1.
+    """
+    count_str, X, y = task
+    design = np.column_stack([np.ones(len(y)), X])
+    beta = np.linalg.lstsq(design, y, rcond=None)[0][1:]
+    importance = np.abs(beta) * X.std(axis=0)
+    if importance.sum() > 0:
+        importance = importance / importance.sum()
+    else:
+        importance = np.full(len(OUTCOME_COLUMNS), 1.0 / len(OUTCOME_COLUMNS))
+
+    weights = {key: round(float(w), 3) for key, w in zip(OUTCOME_COLUMNS, importance)}
+    weights = dict(sorted(weights.items(), key=lambda item: item[1], reverse=True))
+    return count_str, weights, float(y.mean()), len(y)
+
+def difficulty_modifiers(mean_run_values):
+    """Scale each count's average run value (batter's view) onto [MODIFIER_FLOOR, 1.0]"""
+    values = np.array([mean_run_values[c] for c in COUNTS])
+    spread = values.max() - values.min()
+    scaled = (values - values.min()) / spread if spread > 0 else np.ones(len(values))
+    return {c: round(float(MODIFIER_FLOOR + (1 - MODIFIER_FLOOR) * s), 2) for c, s in zip(COUNTS, scaled)}
+
+def refit(store_path, target='delta_run_exp', workers=None):
+    df = load_pitch_store(store_path, STORE_COLUMNS + [target])
+    if target not in df.columns:
+        raise ValueError(f"Pitch store has no '{target}' column")
+    print(f"Total pitches loaded: {len(df)}")
+
+    tasks = split_by_count(df, target)
+    missing = sorted(set(COUNTS) - {task[0] for task in tasks})
+    if missing:
+        raise ValueError(f"No pitches for counts {missing}")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(fit_count, tasks))
+
+    count_weights, mean_run_values, pitches = {}, {}, {}
+    for count_str, weights, mean_run_value, n in results:
+        count_weights[count_str] = weights
+        mean_run_values[count_str] = mean_run_value
+        pitches[count_str] = n
+        print(f"{count_str}: {n} pitches -> {weights}")
+
+    return {
+        'count_weights': {c: count_weights[c] for c in COUNTS},
+        'count_difficulty_modifier': difficulty_modifiers(mean_run_values),
+        'pitches_per_count': {c: pitches[c] for c in COUNTS},
+        'target': target
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Refit COUNT_WEIGHTS and COUNT_DIFFICULTY_MODIFIER from a pitch store")
+    parser.add_argument('store', help="CSV/Parquet file or directory of league-wide Statcast pitches")
+    parser.add_argument('--target', default='delta_run_exp', help="Run value column to explain (default: delta_run_exp)")
+    parser.add_argument('--version', default=datetime.now().strftime('%Y%m%d-%H%M%S'), help="Version label for the weights file")
+    parser.add_argument('--output-dir', default='.', help="Where to write count_weights_<version>.json")
+    parser.add_argument('--workers', type=int, default=None, help="Process pool size (default: CPU count)")
+    parser.add_argument('--activate', action='store_true', help="Also write count_weights.json, which app.py loads at startup")
+    args = parser.parse_args()
+
+    print("=== Count Weights Refit ===\n")
+    result = refit(args.store, args.target, args.workers)
+    result = {
+        'version': args.version,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'source': os.path.abspath(args.store),
+        **result
+    }
+
+    path = os.path.join(args.output_dir, f'count_weights_{args.version}.json')
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved to {path}")
+
+    if args.activate:
+        active_path = os.path.join(args.output_dir, 'count_weights.json')
+        with open(active_path, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Activated as {active_path}")
+
+    print("\n=== Refit Complete ===")
+
+if __name__ == "__main__":
+    main()